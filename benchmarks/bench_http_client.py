@@ -0,0 +1,73 @@
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from benchmarks.mock_api import start_mock_server
+from lib2.Api_Utils import run_openai_api
+from lib2.Http_Client import configure_client
+
+# 旧实现：每张图新建 Session 和 HTTPAdapter
+def post_per_request(image_path, api_url, api_key, timeout):
+    with open(image_path, "rb") as image_file:
+        image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
+    data = {
+        "model": "gpt-4o",
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": "x"},
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}", "detail": "low"}}
+        ]}],
+        "max_tokens": 300
+    }
+    retries = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504],
+                    allowed_methods=["HEAD", "GET", "OPTIONS", "POST"])
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+    with requests.Session() as s:
+        s.mount('http://', HTTPAdapter(max_retries=retries))
+        response = s.post(api_url, headers=headers, json=data, timeout=timeout)
+    return response.json()["choices"][0]["message"]["content"]
+
+
+def run(label, fn, total, workers):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda _: fn(), range(total)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {total} requests in {elapsed:.2f}s -> {total / elapsed:.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-request sessions against the pooled client.")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated server latency in seconds')
+    args = parser.parse_args()
+
+    server, url = start_mock_server(args.latency)
+    configure_client(pool_size=max(args.workers, 1))
+
+    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+        image_path = f.name
+    Image.effect_noise((256, 256), 64).convert('RGB').save(image_path, format='JPEG')
+
+    try:
+        run("per-request session", lambda: post_per_request(image_path, url, "sk-bench", 10), args.requests, args.workers)
+        run("pooled client", lambda: run_openai_api(image_path, "x", "sk-bench", url, "low", 10, use_cache=False),
+            args.requests, args.workers)
+    finally:
+        os.remove(image_path)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from PIL import Image
+
+from lib2.Img_Processing import process_images_in_folder
+
+
+def make_dataset(folder, count, size):
+    # 合成图：噪声 + 渐变，避免过度可压缩
+    base = Image.merge('RGB', [Image.linear_gradient('L').resize(size),
+                               Image.effect_noise(size, 48),
+                               Image.linear_gradient('L').rotate(90).resize(size)])
+    for i in range(count):
+        base.save(os.path.join(folder, f"img_{i:05d}.jpg"), format='JPEG', quality=92)
+
+
+def peak_rss_mb():
+    # Linux 下 ru_maxrss 单位为 KB；它是整个进程生命周期的峰值，所以每种模式在独立子进程中运行
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own / 1024, children / 1024
+
+
+def run(label, source, **kwargs):
+    work = tempfile.mkdtemp(prefix="bench_img_")
+    try:
+        for name in os.listdir(source):
+            shutil.copy(os.path.join(source, name), work)
+        count = len(os.listdir(work))
+        start = time.perf_counter()
+        process_images_in_folder(work, **kwargs)
+        elapsed = time.perf_counter() - start
+        own, children = peak_rss_mb()
+        print(f"{label:<16} {count} images in {elapsed:.2f}s -> {count / elapsed:.2f} img/s | "
+              f"peak RSS self {own:.0f} MB, workers {children:.0f} MB")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark process_images_in_folder on a synthetic folder.")
+    parser.add_argument('--count', type=int, default=48)
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    parser.add_argument('--workers', type=int, default=0)
+    # 内部使用：在子进程中运行单一模式
+    parser.add_argument('--mode', choices=["threads", "processes"], help=argparse.SUPPRESS)
+    parser.add_argument('--source', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        if args.mode == "threads":
+            run("threads", args.source, workers=args.workers or None)
+        else:
+            run("process pool", args.source, use_processes=True, workers=args.workers or None)
+        return
+
+    source = tempfile.mkdtemp(prefix="bench_src_")
+    try:
+        make_dataset(source, args.count, (args.width, args.height))
+        for mode in ("threads", "processes"):
+            subprocess.run([sys.executable, os.path.realpath(__file__), '--mode', mode, '--source', source,
+                            '--workers', str(args.workers)], check=True)
+    finally:
+        shutil.rmtree(source, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 本地模拟 chat/completions 接口，供基准测试使用
+MOCK_LATENCY = 0.0
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if MOCK_LATENCY:
+            time.sleep(MOCK_LATENCY)
+        body = json.dumps({
+            "choices": [{"message": {"content": "mock caption, test, benchmark"}}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 10, "total_tokens": 110}
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(latency=0.0):
+    """Start the mock endpoint on a free local port, return (server, url)."""
+    global MOCK_LATENCY
+    MOCK_LATENCY = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    return server, url
@@ -1,13 +1,17 @@
 import os
 import json
-import base64
 import requests
 import re
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+from lib2 import Caption_Cache
+from lib2.Http_Client import get_session
+from lib2.Rate_Limiter import get_limiter, estimate_request_tokens
+from lib2.Image_Upload import prepare_upload
 
 API_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'api_settings.json')
 QWEN_MOD = 'qwen-vl-plus'
+GPT_MOD = 'gpt-4o'
+ERROR_PREFIXES = ("Error", "API error:", "HTTP Error:", "Timeout Error:", "OOps:", "Failed to parse")
 
 # 扩展prompt {} 标记功能，从文件读取额外内容
 def addition_prompt_process(prompt, image_path):
@@ -76,21 +80,13 @@ def qwen_api(image_path, prompt, api_key):
         caption = response
     return caption
 
-# API使用
-def run_openai_api(image_path, prompt, api_key, api_url, quality=None, timeout=10):
-    prompt = addition_prompt_process(prompt, image_path)
-    # print("prompt{}:",prompt)
+# 请求体构建，图像按细节等级缩放并重新编码
+def encode_image(image_path, quality=None):
+    return prepare_upload(image_path, quality)
 
-    # Qwen-VL
-    if is_ali(api_url):
-        return qwen_api(image_path, prompt, api_key)
-
-    with open(image_path, "rb") as image_file:
-        image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
-
-    # GPT-4V
-    data = {
-        "model": "gpt-4o",
+def build_openai_payload(prompt, image_base64, quality=None, mime="image/jpeg", max_tokens=300):
+    return {
+        "model": GPT_MOD,
         "messages": [
             {
                 "role": "user",
@@ -98,52 +94,249 @@ def run_openai_api(image_path, prompt, api_key, api_url, quality=None, timeout=1
                 [
                     {"type": "text", "text": prompt},
                     {"type": "image_url", "image_url":
-                        {"url": f"data:image/jpeg;base64,{image_base64}",
+                        {"url": f"data:{mime};base64,{image_base64}",
                         "detail": f"{quality}"}
                     }
                 ]
             }
         ],
-        "max_tokens": 300
+        "max_tokens": max_tokens
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
+def parse_openai_response(response_data):
+    if 'error' in response_data:
+        return f"API error: {response_data['error']['message']}"
+    return response_data["choices"][0]["message"]["content"]
+
+def is_error_caption(caption):
+    return not isinstance(caption, str) or caption.startswith(ERROR_PREFIXES)
+
+# 打标缓存，按图像内容、prompt、模型和细节等级索引
+def caption_cache_key(image_path, prompt, api_url, quality):
+    model = QWEN_MOD if is_ali(api_url) else GPT_MOD
+    return Caption_Cache.make_key(image_path, prompt, model, quality)
+
+# API使用
+def run_openai_api(image_path, prompt, api_key, api_url, quality=None, timeout=10, use_cache=True,
+                   retry_throttled=True):
+    prompt = addition_prompt_process(prompt, image_path)
+    # print("prompt{}:",prompt)
+
+    cache_key = None
+    if use_cache:
+        cache_key = caption_cache_key(image_path, prompt, api_url, quality)
+        cached = Caption_Cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    caption = request_caption(image_path, prompt, api_key, api_url, quality, timeout, retry_throttled)
+    if cache_key is not None and not is_error_caption(caption):
+        Caption_Cache.put(cache_key, caption)
+    return caption
+
+def request_caption(image_path, prompt, api_key, api_url, quality=None, timeout=10, retry_throttled=True,
+                    max_tokens=300):
+    # RPM/TPM 限速，请求前预留额度
+    limiter = get_limiter(api_url)
+    if limiter is not None:
+        estimate = estimate_request_tokens(image_path, prompt, quality)
+        reserved = limiter.scale(estimate)
+        limiter.acquire(reserved)
+
+    # Qwen-VL
+    if is_ali(api_url):
+        return qwen_api(image_path, prompt, api_key)
 
-    # 配置重试策略
-    retries = Retry(total=5,
-                    backoff_factor=1,
-                    status_forcelist=[429, 500, 502, 503, 504],
-                    allowed_methods=["HEAD", "GET", "OPTIONS", "POST"])  # 更新参数名
-
-    with requests.Session() as s:
-        s.mount('https://', HTTPAdapter(max_retries=retries))
-
-        try:
-            response = s.post(api_url, headers=headers, json=data, timeout=timeout)
-            response.raise_for_status()
-        # 连接错误回显
-        except requests.exceptions.HTTPError as errh:
-            return f"HTTP Error: {errh}"
-        except requests.exceptions.ConnectionError as errc:
-            return f"Error Connecting: {errc}"
-        except requests.exceptions.Timeout as errt:
-            return f"Timeout Error: {errt}"
-        except requests.exceptions.RequestException as err:
-            return f"OOps: Something Else: {err}"
+    # GPT-4V
+    image_base64, mime = encode_image(image_path, quality)
+    data = build_openai_payload(prompt, image_base64, quality, mime, max_tokens)
+
+    # 复用进程级连接池
+    session = get_session(api_url, api_key, retry_throttled)
+
+    try:
+        response = session.post(api_url, json=data, timeout=timeout)
+        response.raise_for_status()
+    # 连接错误回显
+    except requests.exceptions.HTTPError as errh:
+        return f"HTTP Error: {errh}"
+    except requests.exceptions.ConnectionError as errc:
+        return f"Error Connecting: {errc}"
+    except requests.exceptions.Timeout as errt:
+        return f"Timeout Error: {errt}"
+    except requests.exceptions.RequestException as err:
+        return f"OOps: Something Else: {err}"
 
     try:
         response_data = response.json()
+        if limiter is not None:
+            limiter.reconcile(reserved, estimate, (response_data.get('usage') or {}).get('total_tokens'))
+        return parse_openai_response(response_data)
+    except Exception as e:
+        return f"Failed to parse the API response: {e}\n{response.text}"
 
-        if 'error' in response_data:
-            return f"API error: {response_data['error']['message']}"
+# 多图合并请求：一次请求携带多张图，按编号返回JSON
+MULTI_IMAGE_INSTRUCTION = ("\n\nYou are given {n} images, numbered 1 to {n} in the order they appear. "
+                           "Apply the instructions above to each image separately. Respond only with a JSON object "
+                           "whose keys are the image numbers as strings (\"1\" to \"{n}\") and whose values are "
+                           "the result for that image.")
 
-        caption = response_data["choices"][0]["message"]["content"]
-        return caption
+def build_openai_multi_payload(prompt, images, quality=None):
+    content = [{"type": "text", "text": prompt + MULTI_IMAGE_INSTRUCTION.format(n=len(images))}]
+    for image_base64, mime in images:
+        content.append({"type": "image_url", "image_url":
+                            {"url": f"data:{mime};base64,{image_base64}",
+                             "detail": f"{quality}"}
+                        })
+    return {
+        "model": GPT_MOD,
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": 300 * len(images)
+    }
+
+def load_json_object(text):
+    """The JSON object in a model reply, tolerating ``` fences and surrounding text; None if there is none."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find('{'):]
+    try:
+        data = json.loads(text[text.find('{'):text.rfind('}') + 1])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def parse_multi_response(text, n):
+    """Return {index: caption} for the images the model answered; bad JSON gives {}."""
+    data = load_json_object(text)
+    if data is None:
+        return {}
+    captions = {}
+    for i in range(n):
+        value = data.get(str(i + 1))
+        if isinstance(value, list):
+            value = ", ".join(str(v) for v in value)
+        if isinstance(value, str) and value.strip():
+            captions[i] = value.strip()
+    return captions
+
+def request_captions_multi(image_paths, prompt, api_key, api_url, quality=None, timeout=10, retry_throttled=True):
+    limiter = get_limiter(api_url)
+    if limiter is not None:
+        estimate = sum(estimate_request_tokens(path, "", quality) for path in image_paths) + len(prompt) // 4
+        reserved = limiter.scale(estimate)
+        limiter.acquire(reserved)
+
+    images = [encode_image(path, quality) for path in image_paths]
+    data = build_openai_multi_payload(prompt, images, quality)
+    session = get_session(api_url, api_key, retry_throttled)
+    try:
+        response = session.post(api_url, json=data, timeout=timeout * len(image_paths))
+        response.raise_for_status()
+        response_data = response.json()
+        if limiter is not None:
+            limiter.reconcile(reserved, estimate, (response_data.get('usage') or {}).get('total_tokens'))
+        text = parse_openai_response(response_data)
     except Exception as e:
-        return f"Failed to parse the API response: {e}\n{response.text}"
+        print(f"Multi-image request failed, falling back to single requests: {e}")
+        return {}
+    return parse_multi_response(text, len(image_paths))
+
+def run_openai_api_batch(image_paths, prompt, api_key, api_url, quality=None, timeout=10, use_cache=True,
+                         retry_throttled=True):
+    """
+    Caption several images with one request, returning captions in order.
+    Images the reply does not cover are captioned one by one with run_openai_api.
+    """
+    # {} 扩展prompt按图不同、Qwen-VL 不支持，逐张处理
+    if len(image_paths) == 1 or is_ali(api_url) or '{' in prompt:
+        return [run_openai_api(path, prompt, api_key, api_url, quality, timeout, use_cache, retry_throttled)
+                for path in image_paths]
+
+    captions = [None] * len(image_paths)
+    cache_keys = [None] * len(image_paths)
+    if use_cache:
+        for i, path in enumerate(image_paths):
+            cache_keys[i] = caption_cache_key(path, prompt, api_url, quality)
+            captions[i] = Caption_Cache.get(cache_keys[i])
+
+    todo = [i for i, caption in enumerate(captions) if caption is None]
+    if len(todo) > 1:
+        answered = request_captions_multi([image_paths[i] for i in todo], prompt, api_key, api_url, quality,
+                                          timeout, retry_throttled)
+        for j, caption in answered.items():
+            i = todo[j]
+            captions[i] = caption
+            if cache_keys[i] is not None:
+                Caption_Cache.put(cache_keys[i], caption)
+
+    for i, caption in enumerate(captions):
+        if caption is None:
+            captions[i] = run_openai_api(image_paths[i], prompt, api_key, api_url, quality, timeout, use_cache,
+                                         retry_throttled)
+    return captions
+
+# 单图多任务：一次请求同时返回标签、水印判断和分类回答，图像只上传一次
+MULTI_TASK_INSTRUCTION = ("\n\nAnswer everything in one reply. Respond only with a JSON object "
+                          "with exactly these keys:\n")
+MULTI_TASK_MAX_TOKENS = 600
+DEFAULT_WATERMARK_QUESTION = "Does this image contain a watermark, signature, logo or overlaid text?"
+
+def build_multi_task_prompt(caption_prompt, watermark_prompt="", category_prompt=""):
+    keys = ['"caption": the result of the instructions above, as a string.',
+            '"watermark": true or false. ' + ((watermark_prompt or "").strip() or DEFAULT_WATERMARK_QUESTION)]
+    if (category_prompt or "").strip():
+        keys.append('"category": a short free-text answer to: ' + category_prompt.strip())
+    return caption_prompt + MULTI_TASK_INSTRUCTION + "\n".join(keys)
+
+def parse_multi_task_response(text):
+    """{"caption", "watermark", "category"} from a multi-task reply, or None when it has no usable caption."""
+    data = load_json_object(text)
+    if data is None:
+        return None
+    caption = data.get("caption")
+    if isinstance(caption, list):
+        caption = ", ".join(str(v) for v in caption)
+    if not isinstance(caption, str) or not caption.strip():
+        return None
+    watermark = data.get("watermark")
+    if isinstance(watermark, str):
+        watermark = watermark.strip().lower() in ("true", "yes", "1")
+    category = data.get("category") or ""
+    if isinstance(category, list):
+        category = ", ".join(str(v) for v in category)
+    return {"caption": caption.strip(), "watermark": bool(watermark), "category": str(category).strip()}
+
+def run_multi_task_api(image_path, caption_prompt, watermark_prompt, category_prompt, api_key, api_url,
+                       quality=None, timeout=10, use_cache=True, retry_throttled=True):
+    """
+    Caption, watermark check and category answer for one image in a single request.
+    Returns the parsed dict, or an error string like run_openai_api.
+    """
+    # 仅标签 prompt 需要 {} 扩展，其余问题原样拼接
+    prompt = build_multi_task_prompt(addition_prompt_process(caption_prompt, image_path), watermark_prompt,
+                                     category_prompt)
+
+    cache_key = None
+    if use_cache:
+        cache_key = caption_cache_key(image_path, prompt, api_url, quality)
+        cached = Caption_Cache.get(cache_key)
+        if cached is not None:
+            result = parse_multi_task_response(cached)
+            if result is not None:
+                return result
+
+    text = request_caption(image_path, prompt, api_key, api_url, quality, timeout, retry_throttled,
+                           MULTI_TASK_MAX_TOKENS)
+    if is_error_caption(text):
+        return text
+    result = parse_multi_task_response(text)
+    if result is None:
+        return f"Failed to parse the multi-task response: {text[:200]}"
+    # 只缓存可解析的回答，格式错误的回答下次重新请求
+    if cache_key is not None:
+        Caption_Cache.put(cache_key, text)
+    return result
 
 # API存档
 def save_api_details(api_key, api_url):
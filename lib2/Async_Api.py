@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import aiohttp
+
+from lib2 import Http_Client, Caption_Cache
+from lib2.Api_Utils import addition_prompt_process, is_ali, qwen_api, encode_image, build_openai_payload, \
+    parse_openai_response, caption_cache_key, is_error_caption
+from lib2.Rate_Limiter import get_limiter, estimate_request_tokens
+
+# 异步打标引擎：单事件循环驱动大量并发请求
+DEFAULT_CONCURRENCY = 256
+
+
+def _retry_delay(attempt, retry_after=None):
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return Http_Client.RETRY_BACKOFF * (2 ** attempt)
+
+
+async def run_openai_api_async(session, image_path, prompt, api_key, api_url, quality=None, timeout=10,
+                               use_cache=True):
+    """Async counterpart of run_openai_api, returning the same caption / error strings."""
+    prompt = addition_prompt_process(prompt, image_path)
+
+    cache_key = None
+    if use_cache:
+        cache_key = await asyncio.to_thread(caption_cache_key, image_path, prompt, api_url, quality)
+        cached = await asyncio.to_thread(Caption_Cache.get, cache_key)
+        if cached is not None:
+            return cached
+
+    caption = await request_caption_async(session, image_path, prompt, api_key, api_url, quality, timeout)
+    if cache_key is not None and not is_error_caption(caption):
+        await asyncio.to_thread(Caption_Cache.put, cache_key, caption)
+    return caption
+
+
+async def request_caption_async(session, image_path, prompt, api_key, api_url, quality=None, timeout=10):
+    # RPM/TPM 限速，预留额度后在事件循环中等待，不占用线程
+    limiter = get_limiter(api_url)
+    if limiter is not None:
+        estimate = await asyncio.to_thread(estimate_request_tokens, image_path, prompt, quality)
+        reserved = limiter.scale(estimate)
+        wait = limiter.reserve(reserved)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    # Qwen-VL 走 dashscope 同步SDK，放到线程中执行
+    if is_ali(api_url):
+        return await asyncio.to_thread(qwen_api, image_path, prompt, api_key)
+
+    image_base64, mime = await asyncio.to_thread(encode_image, image_path, quality)
+    data = build_openai_payload(prompt, image_base64, quality, mime)
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+
+    attempt = 0
+    while True:
+        try:
+            async with session.post(api_url, headers=headers, json=data,
+                                    timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.status in Http_Client.RETRY_STATUS and attempt < Http_Client.RETRY_TOTAL:
+                    delay = _retry_delay(attempt, response.headers.get("Retry-After"))
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                response.raise_for_status()
+                text = await response.text()
+        # 连接错误回显
+        except aiohttp.ClientResponseError as errh:
+            return f"HTTP Error: {errh}"
+        except aiohttp.ClientConnectionError as errc:
+            return f"Error Connecting: {errc}"
+        except asyncio.TimeoutError as errt:
+            return f"Timeout Error: {errt}"
+        except aiohttp.ClientError as err:
+            return f"OOps: Something Else: {err}"
+
+        try:
+            response_data = json.loads(text)
+            if limiter is not None:
+                limiter.reconcile(reserved, estimate, (response_data.get('usage') or {}).get('total_tokens'))
+            return parse_openai_response(response_data)
+        except Exception as e:
+            return f"Failed to parse the API response: {e}\n{text}"
+
+
+async def _caption_images(image_paths, prompt, api_key, api_url, quality, timeout, concurrency, on_result, should_stop,
+                          use_cache):
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    results = {}
+    # 固定数量的 worker 依次取图，任务数只与并发数有关，与数据集大小无关
+    pending = iter(image_paths)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def worker():
+            for image_path in pending:
+                if should_stop is not None and should_stop.is_set():
+                    return
+                # 单张图异常（如文件缺失）转为错误标签，不影响其余图片
+                try:
+                    caption = await run_openai_api_async(session, image_path, prompt, api_key, api_url, quality,
+                                                         timeout, use_cache)
+                except Exception as e:
+                    caption = f"OOps: Something Else: {e}"
+                results[image_path] = caption
+                if on_result is None:
+                    continue
+                # 回调会写文件、移动图片、提交 SQLite，放到线程中执行以免阻塞事件循环
+                try:
+                    await asyncio.to_thread(on_result, image_path, caption)
+                except Exception as e:
+                    print(f"An exception occurred while processing {image_path}: {e}")
+
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(image_paths)))))
+
+    return results
+
+
+def caption_images_async(image_paths, prompt, api_key, api_url, quality=None, timeout=10,
+                         concurrency=DEFAULT_CONCURRENCY, on_result=None, should_stop=None, use_cache=True):
+    """
+    Caption many images from one event loop with at most `concurrency` requests in flight.
+    `on_result(image_path, caption)` is called in a worker thread as each image finishes, so it must be
+    thread-safe; returns {image_path: caption}.
+    """
+    concurrency = max(1, int(concurrency))
+    return asyncio.run(_caption_images(image_paths, prompt, api_key, api_url, quality, timeout,
+                                       concurrency, on_result, should_stop, use_cache))
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+
+import requests
+
+from lib2.Api_Utils import addition_prompt_process, encode_image, build_openai_payload, parse_openai_response
+from lib2.Tag_Processor import modify_file_content
+from lib2.Dataset_Index import open_index
+
+# 单个批处理文件上限（OpenAI: 50000 行 / 200 MB）
+MAX_LINES_PER_FILE = 50000
+MAX_BYTES_PER_FILE = 190 * 1024 * 1024
+MANIFEST_NAME = "batch_manifest.json"
+REPORT_ERRORS = 20
+# 不会再产生结果的批次状态
+FINISHED_STATUS = ("ingested", "failed", "cancelled", "expired")
+
+
+class OpenAIBatchTransport:
+    """Upload/poll/download against an OpenAI-compatible /v1 base URL; a local stub server works the same way."""
+
+    def __init__(self, api_key, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def upload_file(self, path):
+        with open(path, 'rb') as f:
+            response = self.session.post(f"{self.base_url}/files", data={"purpose": "batch"},
+                                         files={"file": (os.path.basename(path), f)})
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def create_batch(self, input_file_id):
+        response = self.session.post(f"{self.base_url}/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h"
+        })
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def get_batch(self, batch_id):
+        response = self.session.get(f"{self.base_url}/batches/{batch_id}")
+        response.raise_for_status()
+        return response.json()
+
+    def download_file(self, file_id, out_path):
+        with self.session.get(f"{self.base_url}/files/{file_id}/content", stream=True) as response:
+            response.raise_for_status()
+            with open(out_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+        return out_path
+
+
+def base_url_from_api_url(api_url):
+    # https://api.openai.com/v1/chat/completions -> https://api.openai.com/v1
+    for suffix in ("/chat/completions", "/chat/completions/"):
+        if api_url.endswith(suffix):
+            return api_url[:-len(suffix)]
+    return api_url.rstrip('/')
+
+
+# 默认目录放在数据集旁：图片预处理会删除数据集内的非 jpg/txt 文件
+def default_out_dir(image_dir):
+    image_dir = os.path.abspath(image_dir)
+    return os.path.join(os.path.dirname(image_dir), os.path.basename(image_dir) + "_batch_api")
+
+
+def iter_images(image_dir):
+    yield from open_index(image_dir).images()
+
+
+def _manifest_path(out_dir):
+    return os.path.join(out_dir, MANIFEST_NAME)
+
+
+def load_manifest(out_dir):
+    path = _manifest_path(out_dir)
+    if not os.path.exists(path):
+        return {"files": []}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(out_dir, manifest):
+    path = _manifest_path(out_dir)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# 导出：逐行写入，按行数/字节数分片
+def export_batch_jsonl(image_dir, prompt, quality, out_dir=None):
+    out_dir = out_dir or default_out_dir(image_dir)
+    # 重新导出会覆盖清单，仍在运行的批次将无法写回
+    running = [e["batch_id"] for e in load_manifest(out_dir)["files"]
+               if e.get("batch_id") and e.get("status") not in FINISHED_STATUS]
+    if running:
+        return (f"Error: {len(running)} batch(es) in {out_dir} are not ingested yet ({', '.join(running)}). "
+                f"Check & Ingest them first or choose another JSONL directory. / 错误：仍有未写回的批次")
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {"image_dir": image_dir, "files": []}
+
+    shard, lines, size, f = 0, 0, 0, None
+    total = 0
+    try:
+        for image_path in iter_images(image_dir):
+            image_base64, mime = encode_image(image_path, quality)
+            body = build_openai_payload(addition_prompt_process(prompt, image_path), image_base64, quality, mime)
+            line = json.dumps({
+                "custom_id": os.path.relpath(image_path, image_dir),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body
+            }, ensure_ascii=False) + "\n"
+            encoded = line.encode('utf-8')
+
+            if f is None or lines >= MAX_LINES_PER_FILE or size + len(encoded) > MAX_BYTES_PER_FILE:
+                if f is not None:
+                    f.close()
+                shard += 1
+                path = os.path.join(out_dir, f"batch_{shard:04d}.jsonl")
+                manifest["files"].append({"path": path})
+                f = open(path, 'wb')
+                lines, size = 0, 0
+            f.write(encoded)
+            lines += 1
+            size += len(encoded)
+            total += 1
+    finally:
+        if f is not None:
+            f.close()
+
+    save_manifest(out_dir, manifest)
+    return f"Exported {total} requests into {len(manifest['files'])} file(s) in {out_dir} / 已导出"
+
+
+def submit_batches(out_dir, transport):
+    manifest = load_manifest(out_dir)
+    submitted = 0
+    for entry in manifest["files"]:
+        if entry.get("batch_id"):
+            continue
+        entry["input_file_id"] = transport.upload_file(entry["path"])
+        entry["batch_id"] = transport.create_batch(entry["input_file_id"])
+        entry["status"] = "submitted"
+        submitted += 1
+        save_manifest(out_dir, manifest)
+    return f"Submitted {submitted} batch(es). / 已提交 " + ", ".join(
+        e["batch_id"] for e in manifest["files"] if e.get("batch_id"))
+
+
+# 结果写回：逐行读取，不整体载入内存
+def ingest_results(result_path, image_dir, file_handling_mode, done_path=None):
+    """
+    Write captions from a batch output file; returns (written, failed).
+    Each written custom_id is appended to done_path, so resuming an interrupted ingest
+    does not prepend/append the same caption twice.
+    """
+    done = set()
+    if done_path and os.path.exists(done_path):
+        with open(done_path, 'r', encoding='utf-8') as f:
+            done = {line.rstrip('\n') for line in f if line.strip()}
+    written, failed = 0, 0
+    progress = open(done_path, 'a', encoding='utf-8') if done_path else None
+    try:
+        with open(result_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record["custom_id"] in done:
+                    written += 1
+                    continue
+                if _ingest_record(record, image_dir, file_handling_mode):
+                    written += 1
+                    if progress is not None:
+                        progress.write(record["custom_id"] + "\n")
+                        progress.flush()
+                else:
+                    failed += 1
+    finally:
+        if progress is not None:
+            progress.close()
+    return written, failed
+
+
+def _ingest_record(record, image_dir, file_handling_mode):
+    image_path = os.path.join(image_dir, record["custom_id"])
+    response = record.get("response") or {}
+    try:
+        if record.get("error") or response.get("status_code") != 200:
+            raise ValueError(record.get("error") or response.get("status_code"))
+        caption = parse_openai_response(response["body"])
+        if caption.startswith("API error:"):
+            raise ValueError(caption)
+    except Exception as e:
+        print(f"Batch result failed for {image_path}: {e}")
+        return False
+    caption_path = os.path.splitext(image_path)[0] + ".txt"
+    modify_file_content(caption_path, caption, file_handling_mode)
+    return True
+
+
+def read_errors(error_path):
+    """(custom_id, message) for every request listed in a batch error file."""
+    errors = []
+    with open(error_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            error = record.get("error") or (response.get("body") or {}).get("error") or response.get("status_code")
+            if isinstance(error, dict):
+                error = error.get("message") or error.get("code")
+            errors.append((record.get("custom_id"), str(error)))
+    return errors
+
+
+def poll_and_ingest(out_dir, transport, file_handling_mode):
+    """Check every submitted batch once and write back results of completed ones."""
+    manifest = load_manifest(out_dir)
+    image_dir = manifest.get("image_dir", "")
+    lines = []
+    for entry in manifest["files"]:
+        batch_id = entry.get("batch_id")
+        if not batch_id or entry.get("status") == "ingested":
+            continue
+        batch = transport.get_batch(batch_id)
+        entry["status"] = batch.get("status", "unknown")
+        if entry["status"] == "completed":
+            written, failed = 0, 0
+            if batch.get("output_file_id"):
+                result_path = os.path.splitext(entry["path"])[0] + "_output.jsonl"
+                transport.download_file(batch["output_file_id"], result_path)
+                written, failed = ingest_results(result_path, image_dir, file_handling_mode,
+                                                 os.path.splitext(entry["path"])[0] + "_ingested.txt")
+            # 批次内失败的请求只出现在错误文件中
+            errors = []
+            if batch.get("error_file_id"):
+                error_path = os.path.splitext(entry["path"])[0] + "_errors.jsonl"
+                transport.download_file(batch["error_file_id"], error_path)
+                errors = read_errors(error_path)
+            entry["status"] = "ingested"
+            entry["ingested_at"] = time.time()
+            entry["failed"] = failed + len(errors)
+            lines.append(f"{batch_id}: wrote {written} captions, {failed + len(errors)} failed")
+            for custom_id, message in errors[:REPORT_ERRORS]:
+                lines.append(f"  {custom_id}: {message}")
+            if len(errors) > REPORT_ERRORS:
+                lines.append(f"  ... {len(errors) - REPORT_ERRORS} more failed requests")
+        else:
+            counts = batch.get("request_counts") or {}
+            lines.append(f"{batch_id}: {entry['status']} ({counts.get('completed', 0)}/{counts.get('total', 0)})")
+        save_manifest(out_dir, manifest)
+    return "\n".join(lines) if lines else "No pending batches. / 没有待处理的批次"
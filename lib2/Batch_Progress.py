@@ -0,0 +1,67 @@
+import os
+import time
+import threading
+import collections
+
+# 界面刷新间隔（秒），避免频繁刷新拖慢处理
+UPDATE_INTERVAL = 1.0
+RECENT_CAPTIONS = 5
+
+
+class BatchProgress:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start(0)
+
+    def start(self, total):
+        with self.lock:
+            self.total = total
+            self.done = 0
+            self.errors = 0
+            self.started = time.monotonic()
+            self.recent = collections.deque(maxlen=RECENT_CAPTIONS)
+
+    def record(self, filename, caption=None, ok=True):
+        with self.lock:
+            self.done += 1
+            if not ok:
+                self.errors += 1
+            if caption:
+                self.recent.append((os.path.basename(filename), caption))
+
+    def report(self):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started, 1e-6)
+            rate = self.done / elapsed
+            remaining = self.total - self.done
+            eta = time.strftime('%H:%M:%S', time.gmtime(remaining / rate)) if rate > 0 else "--:--:--"
+            percent = self.done * 100 / self.total if self.total else 100
+            lines = [f"Progress / 进度: {self.done}/{self.total} ({percent:.1f}%) | {rate:.2f} img/s | "
+                     f"ETA {eta} | Errors / 错误: {self.errors}"]
+            for filename, caption in self.recent:
+                lines.append(f"{filename}: {caption[:200]}")
+        return "\n".join(lines)
+
+
+def stream_batch(fn, *args, **kwargs):
+    """
+    Run a blocking batch function in a worker thread and yield progress reports
+    every UPDATE_INTERVAL seconds, then the function's own return value.
+    Each call gets its own BatchProgress, passed to fn as batch_progress, so concurrent runs do not mix counts.
+    """
+    outcome = {}
+    progress = BatchProgress()
+
+    def target():
+        try:
+            outcome["result"] = fn(*args, batch_progress=progress, **kwargs)
+        except Exception as e:
+            outcome["result"] = f"Error: {e}"
+
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    while worker.is_alive():
+        worker.join(UPDATE_INTERVAL)
+        if worker.is_alive():
+            yield progress.report()
+    yield f"{outcome.get('result')}\n{progress.report()}"
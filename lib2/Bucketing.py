@@ -0,0 +1,91 @@
+import bisect
+import hashlib
+import collections
+
+import numpy as np
+
+from lib2.Image_Metadata import MetadataTable
+
+
+def generate_buckets(base_resolution=1024, step=64, min_ratio=0.4, max_ratio=2.5):
+    """
+    All (width, height) pairs that are multiples of `step`, keep the pixel count
+    within base_resolution², and have width/height in [min_ratio, max_ratio].
+    Portrait buckets take the tallest height for each width; landscape buckets
+    are their transposes, so both orientations get the same shapes.
+    """
+    max_pixels = base_resolution * base_resolution
+    buckets = set()
+    width = step
+    while width * width <= max_pixels:
+        height = (max_pixels // width) // step * step
+        if height >= width:
+            for w, h in ((width, height), (height, width)):
+                if min_ratio <= w / h <= max_ratio:
+                    buckets.add((w, h))
+        width += step
+    return sorted(buckets, key=lambda res: res[0] / res[1])
+
+
+class BucketTable:
+    """Bucket set with a sorted aspect-ratio array for binary-search assignment."""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(set(map(tuple, buckets)), key=lambda res: res[0] / res[1])
+        self.ratios = [w / h for w, h in self.buckets]
+        self.signature = hashlib.sha1(repr(self.buckets).encode('utf-8')).hexdigest()[:12]
+
+    def nearest(self, width, height):
+        ratio = width / height
+        i = bisect.bisect_left(self.ratios, ratio)
+        if i == 0:
+            return self.buckets[0]
+        if i == len(self.ratios):
+            return self.buckets[-1]
+        # 与左右相邻比例比较；相等时取较小比例，与 min() 线性扫描结果一致
+        if ratio - self.ratios[i - 1] <= self.ratios[i] - ratio:
+            return self.buckets[i - 1]
+        return self.buckets[i]
+
+    def assign_many(self, sizes):
+        """Vectorised assignment for a list of (width, height); returns bucket indices."""
+        sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+        ratios = np.asarray(self.ratios)
+        query = sizes[:, 0] / sizes[:, 1]
+        if len(ratios) == 1:
+            return np.zeros(len(query), dtype=int)
+        right = np.clip(np.searchsorted(ratios, query), 1, len(ratios) - 1)
+        left = right - 1
+        choose_left = (query - ratios[left]) <= (ratios[right] - query)
+        return np.where(choose_left, left, right)
+
+
+def bucket_table_from_settings(base_resolution, step, min_ratio, max_ratio):
+    """None for the default hardcoded set, otherwise a generated table."""
+    if not base_resolution or base_resolution == "Default":
+        return None
+    return BucketTable(generate_buckets(int(base_resolution), int(step), float(min_ratio), float(max_ratio)))
+
+
+def bucket_histogram(folder_path, table):
+    """Dry run: count how many images in the folder fall into each bucket, from cached header metadata."""
+    metadata = MetadataTable(folder_path)
+    metadata.load()
+    _, failed = metadata.refresh()
+    sizes = metadata.oriented_sizes()
+
+    counts = collections.Counter()
+    if len(sizes):
+        for index in table.assign_many(sizes):
+            counts[table.buckets[int(index)]] += 1
+
+    lines = [f"{len(sizes)} images, {len(table.buckets)} buckets, {failed} unreadable / "
+             f"{len(sizes)} 张图像，{len(table.buckets)} 个分桶"]
+    total = max(len(sizes), 1)
+    for bucket in table.buckets:
+        count = counts.get(bucket, 0)
+        if count:
+            bar = '█' * max(1, round(40 * count / total))
+            lines.append(f"{bucket[0]:>5}x{bucket[1]:<5} {count:>7} {bar}")
+    return "\n".join(lines)
+
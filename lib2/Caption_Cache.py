@@ -0,0 +1,145 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import collections
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'caption_cache.sqlite3')
+
+# 淘汰策略
+MAX_ENTRIES = 200000
+MAX_AGE_DAYS = 90
+EVICT_EVERY = 1000
+# 命中时只记录访问时间，攒够一批再写库，避免每次命中都提交
+TOUCH_FLUSH = 500
+# 文件内容哈希按 (路径, 大小, mtime) 复用
+HASH_CACHE_ITEMS = 100000
+
+_conn = None
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "writes": 0}
+_touched = {}
+_file_hashes = collections.OrderedDict()
+_hash_lock = threading.Lock()
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS captions (
+                key TEXT PRIMARY KEY,
+                caption TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )""")
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON captions(accessed)")
+        _conn.commit()
+    return _conn
+
+
+def hash_file(image_path, chunk_size=1 << 20):
+    stat = os.stat(image_path)
+    memo_key = (os.path.abspath(image_path), stat.st_size, stat.st_mtime)
+    with _hash_lock:
+        digest = _file_hashes.get(memo_key)
+        if digest is not None:
+            _file_hashes.move_to_end(memo_key)
+            return digest
+
+    h = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _hash_lock:
+        _file_hashes[memo_key] = digest
+        while len(_file_hashes) > HASH_CACHE_ITEMS:
+            _file_hashes.popitem(last=False)
+    return digest
+
+
+def make_key(image_path, prompt, model, quality):
+    """Key on image content rather than path, so moved/renamed files still hit."""
+    h = hashlib.sha256()
+    h.update(hash_file(image_path).encode('utf-8'))
+    for part in (prompt, model, quality):
+        h.update(b'\0')
+        h.update(str(part).encode('utf-8'))
+    return h.hexdigest()
+
+
+def get(key):
+    with _lock:
+        conn = _connect()
+        row = conn.execute("SELECT caption FROM captions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            _stats["misses"] += 1
+            return None
+        _stats["hits"] += 1
+        _touched[key] = time.time()
+        if len(_touched) >= TOUCH_FLUSH:
+            _flush_touched(conn)
+        return row[0]
+
+
+def _flush_touched(conn):
+    if not _touched:
+        return
+    conn.executemany("UPDATE captions SET accessed = ? WHERE key = ?",
+                     [(accessed, key) for key, accessed in _touched.items()])
+    conn.commit()
+    _touched.clear()
+
+
+def put(key, caption):
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        conn.execute("INSERT OR REPLACE INTO captions (key, caption, created, accessed) VALUES (?, ?, ?, ?)",
+                     (key, caption, now, now))
+        conn.commit()
+        _stats["writes"] += 1
+        if _stats["writes"] % EVICT_EVERY == 0:
+            _evict(conn)
+
+
+def _evict(conn):
+    # 淘汰按 accessed 排序，先写入未提交的访问时间
+    _flush_touched(conn)
+    if MAX_AGE_DAYS:
+        conn.execute("DELETE FROM captions WHERE created < ?", (time.time() - MAX_AGE_DAYS * 86400,))
+    if MAX_ENTRIES:
+        count = conn.execute("SELECT COUNT(*) FROM captions").fetchone()[0]
+        if count > MAX_ENTRIES:
+            conn.execute("DELETE FROM captions WHERE key IN "
+                         "(SELECT key FROM captions ORDER BY accessed ASC LIMIT ?)", (count - MAX_ENTRIES,))
+    conn.commit()
+
+
+def evict():
+    with _lock:
+        _evict(_connect())
+
+
+def clear():
+    with _lock:
+        conn = _connect()
+        _touched.clear()
+        conn.execute("DELETE FROM captions")
+        conn.commit()
+        conn.execute("VACUUM")
+    return cache_stats()
+
+
+def cache_stats():
+    with _lock:
+        conn = _connect()
+        _flush_touched(conn)
+        count = conn.execute("SELECT COUNT(*) FROM captions").fetchone()[0]
+    size_mb = os.path.getsize(CACHE_PATH) / (1024 * 1024) if os.path.exists(CACHE_PATH) else 0
+    return (f"Entries: {count}, Size: {size_mb:.1f} MB, Hits: {_stats['hits']}, Misses: {_stats['misses']}"
+            f" / 缓存条目: {count}, 命中: {_stats['hits']}, 未命中: {_stats['misses']}")
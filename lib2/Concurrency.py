@@ -0,0 +1,110 @@
+import time
+import threading
+
+from lib2 import Http_Client
+
+# 当前运行中的控制器，供界面实时显示
+current_controller = None
+
+
+class AdaptiveController:
+    """
+    AIMD concurrency window for the threaded batch executors.
+    Grows by ~1 slot per window of healthy responses, halves on 429/503 and
+    pauses new requests for Retry-After.
+    """
+
+    def __init__(self, max_limit=64, initial=4, min_limit=1, decrease_factor=0.5, latency_tolerance=2.0):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self.pause_until = 0.0
+        self.last_cut = 0.0
+        self.baseline = None
+        self.completed = 0
+        self.throttled = 0
+        self.errors = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                wait = self.pause_until - time.monotonic()
+                if wait > 0:
+                    self.cond.wait(wait)
+                elif self.in_flight >= int(self.limit):
+                    self.cond.wait()
+                else:
+                    break
+            self.in_flight += 1
+
+    def _decrease(self, factor, now):
+        # 同一往返周期内只收缩一次，避免并发中的请求连续砍半
+        if now - self.last_cut > (self.baseline or 1.0):
+            self.limit = max(self.min_limit, self.limit * factor)
+            self.last_cut = now
+
+    def release(self, latency, status=None, retry_after=None, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled or status in Http_Client.THROTTLE_STATUS or retry_after:
+                self.throttled += 1
+                self._decrease(self.decrease_factor, now)
+                if retry_after:
+                    self.pause_until = max(self.pause_until, now + retry_after)
+                # 连接层重试后最终成功的请求仍计为完成
+                if status is not None and status < 400:
+                    self.completed += 1
+            elif status is not None and status >= 400:
+                self.errors += 1
+                if status >= 500:
+                    self._decrease(0.9, now)
+            elif status is not None:
+                self.completed += 1
+                if self.baseline is None:
+                    self.baseline = latency
+                if latency > self.baseline * self.latency_tolerance:
+                    self._decrease(0.9, now)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self.baseline = 0.95 * self.baseline + 0.05 * latency
+            self.cond.notify_all()
+
+    def call(self, fn, *args, max_throttle_retries=5, **kwargs):
+        """Run fn inside the window, re-running it only when the final response was a throttle."""
+        for attempt in range(max_throttle_retries + 1):
+            self.acquire()
+            Http_Client.clear_response_info()
+            start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                status, retry_after = Http_Client.last_response_info()
+                self.release(time.monotonic() - start, status, retry_after, Http_Client.was_throttled())
+            if status not in Http_Client.THROTTLE_STATUS:
+                break
+        return result
+
+    def status(self):
+        return (f"Concurrency: {int(self.limit)}/{self.max_limit}, in flight: {self.in_flight}, "
+                f"done: {self.completed}, throttled: {self.throttled}, errors: {self.errors}"
+                f" / 当前并发: {int(self.limit)}")
+
+
+def start_controller(max_limit):
+    global current_controller
+    current_controller = AdaptiveController(max_limit=max_limit)
+    # 工作线程数为 max_limit，连接池需同样大小
+    Http_Client.ensure_pool_size(current_controller.max_limit)
+    return current_controller
+
+
+def concurrency_status():
+    if current_controller is None:
+        return "Adaptive concurrency idle / 自适应并发未运行"
+    return current_controller.status()
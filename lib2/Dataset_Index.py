@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif', '.tiff', '.tif')
+CAPTION_EXTENSION = '.txt'
+
+# 索引文件放在扩展目录下，避免写入数据集目录
+INDEX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'dataset_index')
+WATCH_INTERVAL = 5.0
+# 目录 mtime 距扫描时刻太近时不可信（同一时间粒度内仍可能新增文件），下次重新列出
+MTIME_SETTLE_SECONDS = 2.0
+
+_indexes = {}
+_watchers = {}
+_registry_lock = threading.Lock()
+
+
+class DatasetIndex:
+    """
+    Listing of every file under a folder, built with os.scandir and persisted.
+    A directory whose mtime is unchanged since the last scan is not listed again,
+    so a refresh costs one stat per directory when nothing was added or removed.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.dirs = {}  # rel_dir -> {"mtime", "files": {name: [size, mtime]}, "subdirs": [name]}
+        self.lock = threading.RLock()
+
+    def index_path(self):
+        name = hashlib.sha1(os.path.realpath(self.root).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(INDEX_DIR, name + '.json')
+
+    def load(self):
+        path = self.index_path()
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading dataset index {path}, rescanning: {e}")
+            return
+        if data.get("root") == self.root:
+            self.dirs = data.get("dirs", {})
+
+    def save(self):
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        path = self.index_path()
+        with self.lock:
+            data = json.dumps({"root": self.root, "dirs": self.dirs}, ensure_ascii=False)
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def refresh(self, full=False):
+        """Rescan changed directories (all of them with full); returns the number of directories listed."""
+        with self.lock:
+            old_dirs = {} if full else self.dirs
+            new_dirs = {}
+            listed = 0
+            stack = ['']
+            while stack:
+                rel_dir = stack.pop()
+                abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+                try:
+                    mtime = os.stat(abs_dir).st_mtime
+                except OSError:
+                    continue
+                cached = old_dirs.get(rel_dir)
+                if cached is not None and cached["mtime"] == mtime:
+                    entry = cached
+                else:
+                    entry = self._scan_dir(abs_dir, mtime)
+                    listed += 1
+                new_dirs[rel_dir] = entry
+                stack.extend(os.path.join(rel_dir, name) if rel_dir else name for name in entry["subdirs"])
+            changed = listed > 0 or len(new_dirs) != len(self.dirs)
+            self.dirs = new_dirs
+        if changed:
+            self.save()
+        return listed
+
+    @staticmethod
+    def _scan_dir(abs_dir, mtime):
+        if time.time() - mtime < MTIME_SETTLE_SECONDS:
+            mtime = None
+        files, subdirs = {}, []
+        try:
+            with os.scandir(abs_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            files[entry.name] = [stat.st_size, stat.st_mtime]
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Error scanning {abs_dir}: {e}")
+        return {"mtime": mtime, "files": files, "subdirs": sorted(subdirs)}
+
+    def files(self, extensions=None):
+        """Absolute paths of indexed files, optionally filtered by (lower-case) extension."""
+        with self.lock:
+            snapshot = list(self.dirs.items())
+        paths = []
+        for rel_dir, entry in sorted(snapshot):
+            abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+            for name in sorted(entry["files"]):
+                if extensions is None or name.lower().endswith(extensions):
+                    paths.append(os.path.join(abs_dir, name))
+        return paths
+
+    def images(self):
+        return self.files(IMAGE_EXTENSIONS)
+
+    def captions(self):
+        return self.files((CAPTION_EXTENSION,))
+
+    def siblings(self, path, extensions=IMAGE_EXTENSIONS):
+        """Files in the same directory sharing path's base name, from the index rather than os.path.exists."""
+        rel_dir = os.path.relpath(os.path.dirname(os.path.abspath(path)), self.root)
+        rel_dir = '' if rel_dir == '.' else rel_dir
+        base = os.path.splitext(os.path.basename(path))[0]
+        with self.lock:
+            names = list(self.dirs.get(rel_dir, {}).get("files", {}))
+        return [name for name in names
+                if os.path.splitext(name)[0] == base and name.lower().endswith(extensions)]
+
+    def pairs(self):
+        """(image path, caption path or None) for every indexed image."""
+        result = []
+        for image_path in self.images():
+            caption_path = os.path.splitext(image_path)[0] + CAPTION_EXTENSION
+            rel_dir = os.path.relpath(os.path.dirname(image_path), self.root)
+            with self.lock:
+                names = self.dirs.get('' if rel_dir == '.' else rel_dir, {}).get("files", {})
+                has_caption = os.path.basename(caption_path) in names
+            result.append((image_path, caption_path if has_caption else None))
+        return result
+
+
+def open_index(root, refresh=True):
+    """Shared index for a folder; refreshed unless a watcher is already keeping it current."""
+    key = os.path.realpath(root)
+    with _registry_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = DatasetIndex(root)
+            index.load()
+            _indexes[key] = index
+        watched = key in _watchers
+    if refresh and not watched:
+        index.refresh()
+    return index
+
+
+def start_watch(root, interval=WATCH_INTERVAL):
+    """Keep the folder's index current from a background thread polling directory mtimes."""
+    if not root or not os.path.isdir(root):
+        return "Error: Folder does not exist. / 错误：文件夹不存在"
+    key = os.path.realpath(root)
+    index = open_index(root)
+    with _registry_lock:
+        if key in _watchers:
+            return f"Already watching {root} / 已在监视"
+        stop = threading.Event()
+
+        def watch():
+            while not stop.wait(interval):
+                try:
+                    index.refresh()
+                except Exception as e:
+                    print(f"Error refreshing dataset index for {root}: {e}")
+
+        threading.Thread(target=watch, daemon=True).start()
+        _watchers[key] = stop
+    return f"Watching {root}: {len(index.images())} images, {len(index.captions())} captions / 正在监视"
+
+
+def stop_watch(root):
+    with _registry_lock:
+        stop = _watchers.pop(os.path.realpath(root), None)
+    if stop is None:
+        return f"Not watching {root} / 未在监视"
+    stop.set()
+    return f"Stopped watching {root} / 已停止监视"
+
+
+def index_stats(root):
+    if not root or not os.path.isdir(root):
+        return "Error: Folder does not exist. / 错误：文件夹不存在"
+    index = open_index(root)
+    pairs = index.pairs()
+    captioned = sum(1 for _, caption in pairs if caption)
+    return (f"{len(index.dirs)} folders, {len(pairs)} images, {captioned} with captions, "
+            f"{len(pairs) - captioned} without / {len(pairs)} 张图像，{captioned} 张已有标签")
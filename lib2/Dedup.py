@@ -0,0 +1,192 @@
+import os
+import json
+import threading
+import collections
+import concurrent.futures
+
+import numpy as np
+from PIL import Image
+from scipy.fft import dctn
+
+from lib2.Img_Processing import apply_exif_orientation
+from lib2.Dataset_Index import open_index
+
+HASH_METHODS = ("phash", "dhash")
+# 汉明距离阈值（64 位哈希）
+DEFAULT_THRESHOLD = 4
+READ_WORKERS = 16
+THUMB_SIZE = {"phash": (32, 32), "dhash": (9, 8)}
+# 缩略图分块堆叠计算，内存只与块大小有关
+HASH_CHUNK = 4096
+
+# 同一文件未变化时复用哈希，按最近使用淘汰
+HASH_CACHE_ITEMS = 200000
+_hash_cache = collections.OrderedDict()
+_hash_lock = threading.Lock()
+
+
+def _thumbnail(image_path, method):
+    size = THUMB_SIZE[method]
+    with Image.open(image_path) as img:
+        # JPEG 缩减解码，只需极小的灰度图
+        img.draft('L', (size[0] * 4, size[1] * 4))
+        img = apply_exif_orientation(img)
+        return np.asarray(img.convert('L').resize(size, Image.BILINEAR), dtype=np.float32)
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.astype(np.uint8)).tobytes(), 'big')
+
+
+def hash_thumbnails(thumbnails, method):
+    """Vectorised 64-bit hashes for a stack of grayscale thumbnails (N×H×W)."""
+    if method == "phash":
+        # 32×32 DCT，取左上 8×8 低频分量与中位数比较（不含直流分量）
+        low = dctn(thumbnails, axes=(1, 2), norm='ortho')[:, :8, :8].reshape(len(thumbnails), 64)
+        bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+    else:
+        bits = (thumbnails[:, :, 1:] > thumbnails[:, :, :-1]).reshape(len(thumbnails), 64)
+    return [_bits_to_int(row) for row in bits]
+
+
+def compute_hashes(image_paths, method="phash", workers=READ_WORKERS):
+    """{path: hash} for every readable image; thumbnails are decoded in parallel and hashed in NumPy chunks."""
+    if method not in HASH_METHODS:
+        raise ValueError(f"Unsupported hash method: {method}")
+    hashes, todo = {}, []
+    for path in image_paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        key = (path, stat.st_size, stat.st_mtime, method)
+        with _hash_lock:
+            cached = _hash_cache.get(key)
+            if cached is not None:
+                _hash_cache.move_to_end(key)
+        if cached is None:
+            todo.append((path, key))
+        else:
+            hashes[path] = cached
+
+    def load(item):
+        try:
+            return _thumbnail(item[0], method)
+        except Exception as e:
+            print(f"Error hashing image {item[0]}: {e}")
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(todo), HASH_CHUNK):
+            chunk = todo[start:start + HASH_CHUNK]
+            loaded = [(item, thumb) for item, thumb in zip(chunk, executor.map(load, chunk)) if thumb is not None]
+            if not loaded:
+                continue
+            values = hash_thumbnails(np.stack([thumb for _, thumb in loaded]), method)
+            with _hash_lock:
+                for ((path, key), _), value in zip(loaded, values):
+                    _hash_cache[key] = value
+                    hashes[path] = value
+                while len(_hash_cache) > HASH_CACHE_ITEMS:
+                    _hash_cache.popitem(last=False)
+    return hashes
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance; a radius query visits only children within range."""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, radius):
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.extend(node[1])
+            for d, child in node[2].items():
+                if distance - radius <= d <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+def find_duplicate_clusters(image_paths, threshold=DEFAULT_THRESHOLD, method="phash"):
+    """
+    Groups of near-duplicate images as lists with the representative first.
+    The representative is the largest file in the group, usually the best quality copy,
+    and every other member is within threshold of it (not merely of another member).
+    """
+    hashes = compute_hashes(image_paths, method)
+    tree = BKTree()
+    for path, value in hashes.items():
+        tree.add(value, path)
+
+    # 贪心聚类：按文件大小从大到小取未归类的图作代表，只吸收与代表距离在阈值内的图，避免链式传递
+    sizes = {path: os.path.getsize(path) for path in hashes}
+    assigned = set()
+    clusters = []
+    for representative in sorted(hashes, key=lambda p: (-sizes[p], p)):
+        if representative in assigned:
+            continue
+        members = [p for p in tree.search(hashes[representative], int(threshold)) if p not in assigned]
+        assigned.update(members)
+        assigned.add(representative)
+        if len(members) > 1:
+            others = sorted((p for p in members if p != representative), key=lambda p: (-sizes[p], p))
+            clusters.append([representative] + others)
+    clusters.sort(key=lambda members: (-len(members), members[0]))
+    return clusters
+
+
+def duplicate_map(clusters):
+    """{duplicate path: representative path}"""
+    return {dup: members[0] for members in clusters for dup in members[1:]}
+
+
+def save_cluster_report(clusters, report_path):
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump([{"representative": members[0], "duplicates": members[1:]} for members in clusters], f,
+                  ensure_ascii=False, indent=2)
+    return report_path
+
+
+def format_clusters(clusters, limit=20):
+    duplicates = sum(len(members) - 1 for members in clusters)
+    lines = [f"{len(clusters)} duplicate clusters, {duplicates} duplicate images / "
+             f"{len(clusters)} 组重复，{duplicates} 张重复图像"]
+    for members in clusters[:limit]:
+        lines.append(f"{os.path.basename(members[0])} <- " + ", ".join(os.path.basename(p) for p in members[1:]))
+    if len(clusters) > limit:
+        lines.append(f"... {len(clusters) - limit} more clusters")
+    return "\n".join(lines)
+
+
+def dedup_report(image_dir, threshold=DEFAULT_THRESHOLD, method="phash"):
+    if not image_dir or not os.path.isdir(image_dir):
+        return "Error: Image directory does not exist. / 错误：图片目录不存在"
+    clusters = find_duplicate_clusters(open_index(image_dir).images(), threshold, method)
+    report_path = save_cluster_report(clusters, os.path.join(os.path.dirname(os.path.abspath(image_dir)),
+                                                             "duplicate_clusters.json"))
+    return format_clusters(clusters) + f"\nReport / 报告: {report_path}"
@@ -1,63 +1,124 @@
 import argparse
 import os
+import re
 import shutil
+import sys
+import collections
+import concurrent.futures
+
+# 直接以脚本运行时把仓库根目录加入搜索路径，使 lib2 包可导入
+if __name__ == "__main__" and not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib2.Dataset_Index import open_index
 
 # List of supported image file extensions
 IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif', '.tiff', '.tif']
 
-# Global variable to keep track of the number of moved images
-moved_images_count = 0
-
-# Check and move documents and their associated image files with the same name
-def move_files_with_keywords(source_folder, target_folder, keywords):
-    global moved_images_count
-    # Create the target folder if it doesn't exist
-    if not os.path.exists(target_folder):
-        os.makedirs(target_folder)
-
-    # Iterate through all the files and folders within source_folder
-    for root, dirs, files in os.walk(source_folder):
-        for file in files:
-            if file.endswith('.txt'):
-                file_path = os.path.join(root, file)
-                # Check if the text file contains any of the keywords
-                if has_keywords(file_path, keywords):
-                    # Move the text file
-                    shutil.move(file_path, os.path.join(target_folder, file))
-                    # Move the related image files with the same name
-                    move_related_images(root, file, target_folder)
-
-# Check if the text file contains any of the given keywords
-def has_keywords(file_path, keywords):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        content = file.read()
-        return any(keyword.lower() in content.lower() for keyword in keywords)
-
-# Move the image files with the same name as the text file
-def move_related_images(file_dir, text_file, target_folder):
-    global moved_images_count
-    base_name = os.path.splitext(text_file)[0]
-    for ext in IMAGE_EXTENSIONS:
-        image_file = base_name + ext
-        image_path = os.path.join(file_dir, image_file)
-        if os.path.exists(image_path):
-            shutil.move(image_path, os.path.join(target_folder, image_file))
-            moved_images_count += 1  # Increment the count for each moved image
-
-def main(image_path, keywords):
-    # The target folder will be created in the same directory as image_path
-    target_folder = os.path.join(os.path.dirname(image_path), 'moved_files')
-    move_files_with_keywords(image_path, target_folder, keywords)
+SCAN_WORKERS = 16
+REPORT_ITEMS = 50
+
+
+# 所有关键词合并为一个正则，每个文件只扫描一遍
+def compile_keywords(keywords):
+    keywords = [keyword.strip() for keyword in keywords if keyword.strip()]
+    if not keywords:
+        return None
+    # 长关键词优先，命中时报告最具体的那个
+    pattern = '|'.join(re.escape(keyword) for keyword in sorted(set(keywords), key=len, reverse=True))
+    return re.compile(pattern, re.IGNORECASE)
+
+# Return the first keyword found in the text file, or None
+def find_keyword(file_path, matcher):
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+        match = matcher.search(file.read())
+    return match.group(0).lower() if match else None
+
+def scan_captions(source_folder, matcher, workers=SCAN_WORKERS):
+    """Return (number of captions scanned, [(root, txt file, keyword)]) for captions containing a keyword."""
+    captions = [os.path.split(path) for path in open_index(source_folder).captions()]
+
+    def check(caption):
+        try:
+            return find_keyword(os.path.join(*caption), matcher)
+        except OSError as e:
+            print(f"Error reading {os.path.join(*caption)}: {e}")
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        keywords = list(executor.map(check, captions))
+    return len(captions), [(root, file, keyword) for (root, file), keyword in zip(captions, keywords) if keyword]
+
+# Images with the same name as each caption, from the dataset index instead of os.path.exists per extension
+def related_images(source_folder, hits):
+    index = open_index(source_folder, refresh=False)
+    return {(root, file): index.siblings(os.path.join(root, file), tuple(IMAGE_EXTENSIONS)) for root, file, _ in hits}
+
+def screen_failed_captions(source_folder, keywords, target_folder=None, dry_run=False):
+    """
+    Find captions containing any keyword and move them, with their images, to target_folder.
+    With dry_run nothing is moved. Returns a report dict.
+    """
+    # The target folder will be created in the same directory as source_folder
+    target_folder = target_folder or os.path.join(os.path.dirname(source_folder), 'moved_files')
+    report = {"source": source_folder, "target": target_folder, "dry_run": dry_run, "scanned": 0,
+              "flagged": 0, "moved_captions": 0, "moved_images": 0, "keywords": collections.Counter(), "items": []}
+
+    matcher = compile_keywords(keywords)
+    if matcher is None:
+        return report
+    report["scanned"], hits = scan_captions(source_folder, matcher)
+    report["flagged"] = len(hits)
+    related = related_images(source_folder, hits)
+
+    if hits and not dry_run:
+        os.makedirs(target_folder, exist_ok=True)
+    for root, file, keyword in hits:
+        images = related[(root, file)]
+        report["keywords"][keyword] += 1
+        report["items"].append({"caption": os.path.join(root, file), "keyword": keyword, "images": images})
+        if dry_run:
+            continue
+        try:
+            # Move the text file and the related image files with the same name
+            shutil.move(os.path.join(root, file), os.path.join(target_folder, file))
+            report["moved_captions"] += 1
+            for image_file in images:
+                shutil.move(os.path.join(root, image_file), os.path.join(target_folder, image_file))
+                report["moved_images"] += 1
+        except OSError as e:
+            print(f"Error moving {os.path.join(root, file)}: {e}")
+    return report
+
+def format_report(report):
+    if report["dry_run"]:
+        lines = [f"Dry run / 试运行: {report['flagged']} of {report['scanned']} captions would be moved "
+                 f"with {sum(len(item['images']) for item in report['items'])} images to {report['target']}"]
+    else:
+        lines = [f"Operation complete / 操作完成. Total images moved: {report['moved_images']}. "
+                 f"Captions moved: {report['moved_captions']} of {report['scanned']} scanned. "
+                 f"Moved to folder: {report['target']}"]
+    if report["keywords"]:
+        lines.append("Keywords / 关键词: " + ", ".join(f"{k}: {v}" for k, v in report["keywords"].most_common()))
+    for item in report["items"][:REPORT_ITEMS]:
+        lines.append(f"[{item['keyword']}] {item['caption']} ({len(item['images'])} images)")
+    if len(report["items"]) > REPORT_ITEMS:
+        lines.append(f"... {len(report['items']) - REPORT_ITEMS} more")
+    return "\n".join(lines)
+
+def main(image_path, keywords, dry_run=False):
+    report = screen_failed_captions(image_path, keywords, dry_run=dry_run)
     # Display the message with the count of moved images and the target folder path
-    print(f"Operation complete / 操作完成. Total images moved: {moved_images_count}. Moved to folder: {target_folder}")
+    print(format_report(report))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Move documents containing keywords and their associated image files with the same name.")
     parser.add_argument('--image_path', type=str, help='The path to the folder')
     parser.add_argument('--keywords', type=str, help='List of keywords, separated by commas', default='error,sorry,content')
+    parser.add_argument('--dry_run', action='store_true', help='Only report what would be moved')
     args = parser.parse_args()
-    
+
     # Split the received keyword string into a list
     keywords = args.keywords.split(',')
-    
-    main(args.image_path, keywords)
\ No newline at end of file
+
+    main(args.image_path, keywords, args.dry_run)
@@ -0,0 +1,133 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 连接池配置
+POOL_SIZE = 32
+KEEP_ALIVE = True
+RETRY_TOTAL = 5
+RETRY_BACKOFF = 1
+RETRY_STATUS = [429, 500, 502, 503, 504]
+# 限流状态码，自适应并发模式下交由调用方处理而不在连接层重试
+THROTTLE_STATUS = [429, 503]
+
+# 进程级会话注册表，以 (api_url, api_key, retry_throttled) 为键
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# 记录当前线程最近一次响应的状态码和 Retry-After
+_local = threading.local()
+
+
+def _record_response(response, *args, **kwargs):
+    status = response.status_code
+    # 连接层重试过的限流响应只用于收缩并发，状态码仍取最终响应
+    throttled = status in THROTTLE_STATUS
+    retries = getattr(response.raw, 'retries', None)
+    for history in getattr(retries, 'history', None) or ():
+        if history.status in THROTTLE_STATUS:
+            throttled = True
+    _local.status = status
+    _local.throttled = throttled
+    _local.retry_after = response.headers.get("Retry-After")
+
+
+def clear_response_info():
+    _local.status = None
+    _local.throttled = False
+    _local.retry_after = None
+
+
+def was_throttled():
+    """Whether the last request on this thread met a 429/503, including ones retried by urllib3."""
+    return getattr(_local, 'throttled', False)
+
+
+def last_response_info():
+    """Return (status, retry_after_seconds) of the last response seen on this thread."""
+    status = getattr(_local, 'status', None)
+    retry_after = getattr(_local, 'retry_after', None)
+    try:
+        retry_after = float(retry_after) if retry_after else None
+    except ValueError:
+        retry_after = None
+    return status, retry_after
+
+
+def _build_session(api_key, retry_throttled=True):
+    status_forcelist = RETRY_STATUS if retry_throttled else [s for s in RETRY_STATUS if s not in THROTTLE_STATUS]
+    # 不重试限流时也不按 Retry-After 重试，否则 urllib3 会在工作线程里等待后重发
+    retries = Retry(total=RETRY_TOTAL,
+                    backoff_factor=RETRY_BACKOFF,
+                    status_forcelist=status_forcelist,
+                    allowed_methods=["HEAD", "GET", "OPTIONS", "POST"],
+                    respect_retry_after_header=retry_throttled)
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retries)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    })
+    if not KEEP_ALIVE:
+        session.headers["Connection"] = "close"
+    session.hooks['response'].append(_record_response)
+    return session
+
+
+def get_session(api_url, api_key, retry_throttled=True):
+    """Return the shared, pooled session for an endpoint/key pair."""
+    key = (api_url, api_key, retry_throttled)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _build_session(api_key, retry_throttled)
+                _sessions[key] = session
+    return session
+
+
+def ensure_pool_size(size):
+    """Grow the connection pool to at least size, so that many worker threads do not discard connections."""
+    global POOL_SIZE
+    if int(size) > POOL_SIZE:
+        POOL_SIZE = int(size)
+        replace_sessions()
+
+
+def replace_sessions():
+    """
+    Swap every registered session for one built with the current settings.
+    Old sessions are not closed: callers already holding them finish their requests and they are garbage collected.
+    """
+    with _sessions_lock:
+        for key in list(_sessions):
+            _sessions[key] = _build_session(key[1], key[2])
+
+
+def close_all_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def configure_client(pool_size=None, keep_alive=None, retry_total=None, retry_backoff=None, retry_status=None):
+    """Update pool/retry settings; existing sessions are replaced so the next request picks them up."""
+    global POOL_SIZE, KEEP_ALIVE, RETRY_TOTAL, RETRY_BACKOFF, RETRY_STATUS
+    if pool_size is not None:
+        POOL_SIZE = max(1, int(pool_size))
+    if keep_alive is not None:
+        KEEP_ALIVE = bool(keep_alive)
+    if retry_total is not None:
+        RETRY_TOTAL = max(0, int(retry_total))
+    if retry_backoff is not None:
+        RETRY_BACKOFF = float(retry_backoff)
+    if retry_status is not None:
+        RETRY_STATUS = list(retry_status)
+    replace_sessions()
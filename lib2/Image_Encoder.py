@@ -0,0 +1,82 @@
+import io
+import hashlib
+
+# 输出格式：扩展名与 Pillow 格式名
+OUTPUT_FORMATS = {
+    "JPEG": ".jpg",
+    "WEBP": ".webp",
+    "WEBP_LOSSLESS": ".webp",
+}
+SUBSAMPLING = ("4:4:4", "4:2:2", "4:2:0")
+# 按体积上限搜索时允许的最低质量
+MIN_QUALITY = 60
+
+
+class EncoderSettings:
+    """Output options for preprocessed images; a plain object so it can be sent to worker processes."""
+
+    def __init__(self, format="JPEG", quality=95, max_bytes=0, subsampling="4:2:0", progressive=True,
+                 min_quality=MIN_QUALITY):
+        format = (format or "JPEG").upper().replace(" ", "_")
+        if format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {format}")
+        if subsampling not in SUBSAMPLING:
+            raise ValueError(f"Unsupported chroma subsampling: {subsampling}")
+        self.format = format
+        self.quality = int(quality)
+        self.max_bytes = int(max_bytes or 0)
+        self.subsampling = subsampling
+        self.progressive = bool(progressive)
+        self.min_quality = min(int(min_quality), self.quality)
+        self.extension = OUTPUT_FORMATS[format]
+        self.signature = hashlib.sha1(repr((self.format, self.quality, self.max_bytes, self.subsampling,
+                                            self.progressive, self.min_quality)).encode('utf-8')).hexdigest()[:12]
+
+    def encode(self, img, quality=None):
+        quality = self.quality if quality is None else quality
+        buffer = io.BytesIO()
+        if self.format == "JPEG":
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=self.progressive,
+                     subsampling=self.subsampling)
+        elif self.format == "WEBP":
+            img.save(buffer, format='WEBP', quality=quality, method=4)
+        else:
+            img.save(buffer, format='WEBP', lossless=True, quality=100, method=4)
+        return buffer.getvalue()
+
+    def encode_to_target(self, img):
+        """
+        Encode at the configured quality, or, when max_bytes is set, at the highest
+        quality in [min_quality, quality] whose output fits; returns (data, quality).
+        """
+        data = self.encode(img)
+        if not self.max_bytes or self.format == "WEBP_LOSSLESS" or len(data) <= self.max_bytes:
+            return data, self.quality
+
+        # 二分查找满足体积上限的最高质量
+        low, high = self.min_quality, self.quality - 1
+        best = None
+        while low <= high:
+            mid = (low + high) // 2
+            candidate = self.encode(img, mid)
+            if len(candidate) <= self.max_bytes:
+                best = (candidate, mid)
+                low = mid + 1
+            else:
+                high = mid - 1
+        if best is None:
+            # 最低质量仍超出上限时按最低质量输出
+            return self.encode(img, self.min_quality), self.min_quality
+        return best
+
+
+DEFAULT_ENCODER = EncoderSettings()
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
@@ -0,0 +1,183 @@
+import os
+import hashlib
+import concurrent.futures
+
+import numpy as np
+from PIL import Image
+
+from lib2.Dataset_Index import open_index, INDEX_DIR
+
+READ_WORKERS = 32
+# 模式与格式以小整数编码，列式存储
+MODES = ["?", "1", "L", "LA", "P", "RGB", "RGBA", "CMYK", "YCbCr", "I", "F", "I;16"]
+FORMATS = ["?", "JPEG", "PNG", "WEBP", "BMP", "GIF", "TIFF", "MPO"]
+COLUMNS = ("size", "mtime", "width", "height", "orientation", "mode", "format")
+DTYPES = {"size": np.int64, "mtime": np.float64, "width": np.int32, "height": np.int32,
+          "orientation": np.int8, "mode": np.int8, "format": np.int8}
+
+
+def read_header(image_path):
+    """(width, height, orientation, mode code, format code) from the header only; pixels are not decoded."""
+    with Image.open(image_path) as img:
+        width, height = img.size
+        try:
+            orientation = img.getexif().get(0x0112) or 1
+        except Exception:
+            orientation = 1
+        mode = MODES.index(img.mode) if img.mode in MODES else 0
+        fmt = FORMATS.index(img.format) if img.format in FORMATS else 0
+    return width, height, int(orientation) if 1 <= int(orientation) <= 8 else 1, mode, fmt
+
+
+class MetadataTable:
+    """
+    Per-image header metadata for a folder as NumPy columns, cached next to the dataset index.
+    Relative paths are kept as one UTF-8 byte buffer plus offsets rather than a fixed-width string array.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.path_data = np.zeros(0, dtype=np.uint8)
+        self.path_offsets = np.zeros(1, dtype=np.int64)
+        self.columns = {name: np.array([], dtype=DTYPES[name]) for name in COLUMNS}
+
+    def cache_path(self):
+        name = hashlib.sha1(os.path.realpath(self.root).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(INDEX_DIR, name + '_meta.npz')
+
+    def load(self):
+        path = self.cache_path()
+        if not os.path.exists(path):
+            return
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                self.path_data = data["path_data"]
+                self.path_offsets = data["path_offsets"]
+                self.columns = {name: data[name] for name in COLUMNS}
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error reading metadata cache {path}, rebuilding: {e}")
+
+    def save(self):
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        path = self.cache_path()
+        # np.savez 会自动补 .npz 后缀，临时文件名需以 .npz 结尾
+        tmp_path = path[:-4] + '.tmp.npz'
+        np.savez_compressed(tmp_path, path_data=self.path_data, path_offsets=self.path_offsets, **self.columns)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.path_offsets) - 1
+
+    def paths(self):
+        """Relative paths of all rows, decoded from the byte buffer."""
+        data = self.path_data.tobytes()
+        offsets = self.path_offsets.tolist()
+        return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(self))]
+
+    def _set_paths(self, paths):
+        encoded = [rel.encode('utf-8') for rel in paths]
+        self.path_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(rel) for rel in encoded], out=self.path_offsets[1:])
+        self.path_data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    def oriented_sizes(self):
+        """(width, height) after EXIF rotation, as an N×2 array."""
+        swap = np.isin(self.columns["orientation"], (5, 6, 7, 8))
+        width = np.where(swap, self.columns["height"], self.columns["width"])
+        height = np.where(swap, self.columns["width"], self.columns["height"])
+        return np.stack([width, height], axis=1)
+
+    def refresh(self, workers=READ_WORKERS):
+        """Re-read headers of new or changed images in parallel; returns (read, failed)."""
+        previous = {rel: i for i, rel in enumerate(self.paths())}
+        image_paths = open_index(self.root).images()
+
+        def read(image_path):
+            rel = os.path.relpath(image_path, self.root)
+            try:
+                stat = os.stat(image_path)
+            except OSError:
+                return None
+            i = previous.get(rel)
+            if i is not None and self.columns["size"][i] == stat.st_size and self.columns["mtime"][i] == stat.st_mtime:
+                return rel, i
+            try:
+                return rel, (stat.st_size, stat.st_mtime) + read_header(image_path)
+            except Exception as e:
+                print(f"Error reading image header {image_path}: {e}")
+                return None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(read, image_paths))
+
+        rows = [r for r in results if r is not None]
+        failed = len(results) - len(rows)
+        # 未变化的行直接从旧列复制，只有新读取的行需要组装
+        kept = np.array([row if isinstance(row, int) else -1 for _, row in rows], dtype=np.int64)
+        has_old = kept >= 0
+        new_rows = [row for _, row in rows if not isinstance(row, int)]
+        fresh = len(new_rows)
+        columns = {}
+        for c, name in enumerate(COLUMNS):
+            column = np.empty(len(rows), dtype=DTYPES[name])
+            if has_old.any():
+                column[has_old] = self.columns[name][kept[has_old]]
+            if new_rows:
+                column[~has_old] = np.array([row[c] for row in new_rows], dtype=DTYPES[name])
+            columns[name] = column
+
+        changed = fresh > 0 or len(rows) != len(self)
+        self._set_paths([rel for rel, _ in rows])
+        self.columns = columns
+        if changed:
+            self.save()
+        return fresh, failed
+
+
+def load_metadata(folder_path):
+    table = MetadataTable(folder_path)
+    table.load()
+    table.refresh()
+    return table
+
+
+def _text_histogram(title, values, edges, labels):
+    counts, _ = np.histogram(values, bins=edges)
+    total = max(int(counts.sum()), 1)
+    lines = [title]
+    for label, count in zip(labels, counts):
+        bar = '█' * round(40 * count / total) if count else ''
+        lines.append(f"  {label:>14} {int(count):>8} {bar}")
+    return lines
+
+
+def metadata_report(folder_path):
+    if not folder_path or not os.path.isdir(folder_path):
+        return "Error: Folder does not exist. / 错误：文件夹不存在"
+    table = load_metadata(folder_path)
+    if not len(table):
+        return "No images found. / 未找到图像"
+    sizes = table.oriented_sizes().astype(np.float64)
+    megapixels = sizes[:, 0] * sizes[:, 1] / 1e6
+    aspect = sizes[:, 0] / np.maximum(sizes[:, 1], 1)
+    file_mb = table.columns["size"] / (1024 * 1024)
+
+    lines = [f"{len(table)} images, {file_mb.sum():.1f} MB total, median {np.median(sizes[:, 0]):.0f}x"
+             f"{np.median(sizes[:, 1]):.0f} / {len(table)} 张图像"]
+    lines += _text_histogram("Resolution (MP) / 分辨率（百万像素）", megapixels,
+                             [0, 0.25, 0.5, 1, 2, 4, 8, 16, np.inf],
+                             ["<0.25", "0.25-0.5", "0.5-1", "1-2", "2-4", "4-8", "8-16", ">16"])
+    lines += _text_histogram("Aspect ratio (W/H) / 宽高比", aspect,
+                             [0, 0.5, 0.67, 0.8, 0.95, 1.05, 1.25, 1.5, 2, np.inf],
+                             ["<0.5", "0.5-0.67", "0.67-0.8", "0.8-0.95", "~1", "1.05-1.25", "1.25-1.5", "1.5-2",
+                              ">2"])
+    lines += _text_histogram("File size (MB) / 文件大小", file_mb,
+                             [0, 0.1, 0.25, 0.5, 1, 2, 5, 10, np.inf],
+                             ["<0.1", "0.1-0.25", "0.25-0.5", "0.5-1", "1-2", "2-5", "5-10", ">10"])
+    modes = np.bincount(table.columns["mode"].astype(np.int64), minlength=len(MODES))
+    formats = np.bincount(table.columns["format"].astype(np.int64), minlength=len(FORMATS))
+    lines.append("Modes / 色彩模式: " + ", ".join(f"{MODES[i]}: {n}" for i, n in enumerate(modes) if n))
+    lines.append("Formats / 格式: " + ", ".join(f"{FORMATS[i]}: {n}" for i, n in enumerate(formats) if n))
+    rotated = int(np.count_nonzero(table.columns["orientation"] != 1))
+    lines.append(f"EXIF rotated / 需按EXIF旋转: {rotated}")
+    return "\n".join(lines)
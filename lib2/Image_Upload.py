@@ -0,0 +1,95 @@
+import io
+import os
+import base64
+import threading
+import collections
+
+from PIL import Image
+
+from lib2.Img_Processing import apply_exif_orientation, exif_orientation
+
+# 接口可直接接受的格式
+UPLOAD_MIME = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'GIF': 'image/gif',
+}
+# 无需缩放且体积不大时直接上传原文件
+PASSTHROUGH_BYTES = 512 * 1024
+JPEG_QUALITY = 90
+
+# 已编码图像的内存缓存
+PAYLOAD_CACHE_MB = 256
+_payload_cache = collections.OrderedDict()
+_payload_cache_bytes = 0
+_payload_lock = threading.Lock()
+
+
+def upload_size(width, height, quality):
+    """Largest size the chosen detail level can make use of."""
+    if quality == "low":
+        scale = min(1.0, 512 / max(width, height))
+    else:
+        # high/auto: 先缩至 2048 内，再把短边缩至 768
+        scale = min(1.0, 2048 / max(width, height))
+        scale *= min(1.0, 768 / (min(width, height) * scale))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _encode(image_path, quality):
+    with Image.open(image_path) as img:
+        # 目标尺寸按EXIF旋转后的宽高计算，与 apply_exif_orientation 的旋转一致
+        rotated = exif_orientation(img) in (6, 8)
+        width, height = (img.height, img.width) if rotated else img.size
+        size = upload_size(width, height, quality)
+        if img.format in UPLOAD_MIME and size == img.size and os.path.getsize(image_path) <= PASSTHROUGH_BYTES:
+            with open(image_path, 'rb') as f:
+                return f.read(), UPLOAD_MIME[img.format]
+
+        # JPEG 按目标尺寸缩减解码（解码发生在旋转之前，用未旋转的宽高）
+        if img.format == 'JPEG':
+            img.draft('RGB', (size[1], size[0]) if rotated else size)
+        img = apply_exif_orientation(img)
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+        if img.size != size:
+            img = img.resize(size, Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        if has_alpha:
+            img.save(buffer, format='WEBP', quality=JPEG_QUALITY)
+            return buffer.getvalue(), 'image/webp'
+        img.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+        return buffer.getvalue(), 'image/jpeg'
+
+
+def prepare_upload(image_path, quality=None):
+    """Return (base64, mime) for an image resized and re-encoded for the detail level."""
+    global _payload_cache_bytes
+    stat = os.stat(image_path)
+    key = (image_path, stat.st_size, stat.st_mtime, quality)
+    with _payload_lock:
+        cached = _payload_cache.get(key)
+        if cached is not None:
+            _payload_cache.move_to_end(key)
+            return cached
+
+    try:
+        data, mime = _encode(image_path, quality)
+    except Exception as e:
+        # 无法解码时按原文件上传
+        print(f"Error preparing {image_path} for upload, sending original file: {e}")
+        with open(image_path, 'rb') as f:
+            data, mime = f.read(), 'image/jpeg'
+    payload = (base64.b64encode(data).decode('utf-8'), mime)
+
+    with _payload_lock:
+        if key in _payload_cache:
+            return _payload_cache[key]
+        _payload_cache[key] = payload
+        _payload_cache_bytes += len(payload[0])
+        while _payload_cache_bytes > PAYLOAD_CACHE_MB * 1024 * 1024 and len(_payload_cache) > 1:
+            _, (old, _) = _payload_cache.popitem(last=False)
+            _payload_cache_bytes -= len(old)
+    return payload
@@ -1,11 +1,23 @@
 import os
-import subprocess
+import sys
+import json
+import hashlib
+import functools
 import concurrent.futures
 
+# 直接以脚本运行时把仓库根目录加入搜索路径，使 lib2 包可导入
+if __name__ == "__main__" and not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from PIL import Image
 from tqdm import tqdm
 from PIL import Image, ExifTags
 
+from lib2.Bucketing import BucketTable, generate_buckets
+from lib2.Image_Encoder import EncoderSettings, DEFAULT_ENCODER, format_bytes
+from lib2.Failed_Tagging_File_Screening import screen_failed_captions, format_report
+from lib2.Dataset_Index import open_index
+
 target_resolutions = [
     (640, 1632),   # 640 * 1632 = 1044480
     (704, 1472),   # 704 * 1472 = 1036288
@@ -27,6 +39,18 @@ target_resolutions = [
     # (1024, 1024),  # 1024 * 1024 = 1048576
 ]
 
+IMAGE_EXTENSIONS = (".jpg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".jpeg", ".webp")
+# 预处理清单，记录已处理图像，重复运行时跳过未变化的文件
+MANIFEST_NAME = ".preprocess_manifest.json"
+
+# 缩放比例低于此值时，JPEG 直接按缩小尺寸解码
+DRAFT_THRESHOLD = 0.5
+# LANCZOS 前先做整数倍 reduce，兼顾速度与质量
+REDUCING_GAP = 3.0
+
+# 默认分桶：上面的固定列表，按宽高比排序后二分查找
+DEFAULT_BUCKETS = BucketTable(target_resolutions)
+
 # 图像预处理
 def apply_exif_orientation(image):
     try:
@@ -51,33 +75,62 @@ def apply_exif_orientation(image):
 
     return image
 
-def convert_image_to_jpg(img, img_path):
-    """Convert an Image object to JPG."""
-    # Remove extension from original filename and add .jpg
+def convert_image_to_jpg(img, img_path, encoder=None):
+    """Convert an Image object to JPG (or the encoder's output format); returns (path, bytes written)."""
+    encoder = encoder or DEFAULT_ENCODER
+    # Remove extension from original filename and add the output extension
     base_name = os.path.splitext(img_path)[0]
-    jpg_path = base_name + '.jpg'
+    jpg_path = base_name + encoder.extension
     
     # Convert image to RGB if it is RGBA (or any other mode)
     if img.mode != 'RGB':
         img = img.convert('RGB')
     
-    img.save(jpg_path, format='JPEG', quality=100)
+    data, _ = encoder.encode_to_target(img)
+    with open(jpg_path, 'wb') as f:
+        f.write(data)
+    return jpg_path, len(data)
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def exif_orientation(image):
+    try:
+        return image.getexif().get(0x0112)
+    except Exception:
+        return None
 
-def process_image(img_path):
+def process_image(img_path, buckets=None, encoder=None):
+    buckets = buckets or DEFAULT_BUCKETS
+    encoder = encoder or DEFAULT_ENCODER
     try:
-        if img_path.lower().endswith((".jpg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".jpeg", ".webp")):
+        if img_path.lower().endswith(IMAGE_EXTENSIONS):
+            source_hash = file_hash(img_path)
+            bytes_in = os.path.getsize(img_path)
             img = Image.open(img_path)
+
+            # 按EXIF旋转后的尺寸计算宽高比，此时尚未解码像素
+            width, height = img.size
+            if exif_orientation(img) in (6, 8):
+                width, height = height, width
+
+            # 找到最接近原图像宽高比的目标分辨率
+            target_resolution = buckets.nearest(width, height)
+
+            # JPEG 缩减解码：目标远小于原图时只解码 1/2、1/4 或 1/8 尺寸
+            scale = max(target_resolution[0] / width, target_resolution[1] / height)
+            if img.format == 'JPEG' and scale < DRAFT_THRESHOLD:
+                img.draft('RGB', (int(img.width * scale) + 1, int(img.height * scale) + 1))
+
             img = apply_exif_orientation(img)  # Apply the EXIF orientation
 
             # Convert to 'RGB' if it is 'RGBA' or any other mode
             img = img.convert('RGB')
 
-            # 计算原图像的宽高比
-            original_aspect_ratio = img.width / img.height
-
-            # 找到最接近原图像宽高比的目标分辨率
-            target_resolution = min(target_resolutions, key=lambda res: abs(original_aspect_ratio - res[0] / res[1]))
-
             # 计算新的维度
             if img.width / target_resolution[0] < img.height / target_resolution[1]:
                 new_width = target_resolution[0]
@@ -87,7 +140,7 @@ def process_image(img_path):
                 new_width = int(img.width * target_resolution[1] / img.height)
 
             # 等比缩放图像
-            img = img.resize((new_width, new_height), Image.LANCZOS)
+            img = img.resize((new_width, new_height), Image.LANCZOS, reducing_gap=REDUCING_GAP)
 
             # 计算裁剪的区域
             left = int((img.width - target_resolution[0]) / 2)
@@ -99,49 +152,156 @@ def process_image(img_path):
             img = img.crop((left, top, right, bottom))
 
             # 转换并保存图像为JPG格式
-            convert_image_to_jpg(img, img_path)
+            jpg_path, bytes_out = convert_image_to_jpg(img, img_path, encoder)
+            return {"path": jpg_path, "source_hash": source_hash, "bucket": list(target_resolution),
+                    "bucket_set": buckets.signature, "encoder": encoder.signature,
+                    "bytes_in": bytes_in, "bytes_out": bytes_out}
 
     except Exception as e:
         print(f"Error processing image {img_path}: {e}")
-        return None
+        return {"path": img_path, "error": str(e)}
+
+def delete_non_jpg_files(folder_path, keep_extension=".jpg"):
+    """Delete all non-jpg (or non keep_extension) image files in a directory, but keep txt files."""
+    index = open_index(folder_path, refresh=False)
+    # 处理过程中新建了文件，先刷新索引
+    index.refresh()
+    for file_path in index.files():
+        filename = os.path.basename(file_path)
+        if not filename.lower().endswith((keep_extension, ".txt")) and filename != MANIFEST_NAME:
+            try:
+                os.remove(file_path)
+            except Exception as e:
+                print(f"Error occurred while deleting file : {file_path}. Error : {str(e)}")
+
+def load_manifest(folder_path):
+    manifest_path = os.path.join(folder_path, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading manifest {manifest_path}, reprocessing all images: {e}")
+    return {}
+
+def save_manifest(folder_path, manifest):
+    manifest_path = os.path.join(folder_path, MANIFEST_NAME)
+    with open(manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
 
-def delete_non_jpg_files(folder_path):
-    """Delete all non-jpg image files in a directory, but keep txt files."""
-    for dirpath, dirnames, filenames in os.walk(folder_path):
-        for filename in filenames:
-            if not filename.lower().endswith((".jpg", ".txt")):
-                file_path = os.path.join(dirpath, filename)
-                try:
-                    os.remove(file_path)
-                except Exception as e:
-                    print(f"Error occurred while deleting file : {file_path}. Error : {str(e)}")
-
-def process_images_in_folder(folder_path):
+def is_unchanged(path, entry, stat, bucket_set=DEFAULT_BUCKETS.signature, encoder=DEFAULT_ENCODER.signature):
+    if entry is None or entry.get("size") != stat.st_size:
+        return False
+    # 分桶或编码设置变化后需要重新处理
+    if entry.get("bucket_set", DEFAULT_BUCKETS.signature) != bucket_set or entry.get("encoder") != encoder:
+        return False
+    if entry.get("mtime") == stat.st_mtime:
+        return True
+    # 仅修改时间变化时比对内容
+    if file_hash(path) == entry.get("output_hash"):
+        entry["mtime"] = stat.st_mtime
+        return True
+    return False
+
+def process_images_in_folder(folder_path, use_processes=False, workers=None, force=False, buckets=None,
+                             encoder=None):
     """
     Process all images in the given folder according to the target resolutions,
     then delete all non-jpg files except for .txt files.
+    Decoding and resizing are CPU-bound, so use_processes runs them in a process pool.
+    Images already recorded in the folder manifest with the same size/mtime are skipped unless force is set.
+    buckets is a BucketTable; the default is the fixed target_resolutions list.
+    encoder is an EncoderSettings controlling output format, quality and size target.
     """
-    processed_files = []
+    buckets = buckets or DEFAULT_BUCKETS
+    encoder = encoder or DEFAULT_ENCODER
+    manifest = {} if force else load_manifest(folder_path)
+
+    file_list = []
+    skipped = 0
+    for file_path in open_index(folder_path).files(IMAGE_EXTENSIONS):
+        rel_path = os.path.relpath(file_path, folder_path)
+        if not force and is_unchanged(file_path, manifest.get(rel_path), os.stat(file_path), buckets.signature,
+                                     encoder.signature):
+            skipped += 1
+        else:
+            file_list.append(file_path)
+
+    workers = int(workers) if workers else None
+    worker_fn = functools.partial(process_image, buckets=buckets, encoder=encoder)
+    if use_processes:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(tqdm(executor.map(worker_fn, file_list, chunksize=8), total=len(file_list)))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(tqdm(executor.map(worker_fn, file_list), total=len(file_list)))
 
-    file_list = [os.path.join(dirpath, filename)
-                 for dirpath, dirnames, filenames in os.walk(folder_path)
-                 for filename in filenames]
+    processed, failed = 0, 0
+    bytes_in, bytes_out = 0, 0
+    for result in results:
+        if result is None:
+            continue
+        if "error" in result:
+            failed += 1
+            continue
+        stat = os.stat(result["path"])
+        manifest[os.path.relpath(result["path"], folder_path)] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "source_hash": result["source_hash"],
+            "bucket": result["bucket"],
+            "bucket_set": result["bucket_set"],
+            "encoder": result["encoder"],
+            "output_hash": file_hash(result["path"])
+        }
+        processed += 1
+        bytes_in += result["bytes_in"]
+        bytes_out += result["bytes_out"]
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        list(tqdm(executor.map(process_image, file_list), total=len(file_list)))
+    delete_non_jpg_files(folder_path, encoder.extension)
 
-    delete_non_jpg_files(folder_path)
-    return f"Processed images in folder: {folder_path}"
+    # 清理已不存在文件的记录
+    manifest = {rel: entry for rel, entry in manifest.items() if os.path.exists(os.path.join(folder_path, rel))}
+    save_manifest(folder_path, manifest)
+    return (f"Processed images in folder: {folder_path}. Processed: {processed}, skipped: {skipped}, failed: {failed}"
+            f" / 已处理 {processed}，跳过 {skipped}，失败 {failed}\n"
+            f"Size: {format_bytes(bytes_in)} -> {format_bytes(bytes_out)}, saved {format_bytes(bytes_in - bytes_out)}"
+            f" / 节省 {format_bytes(bytes_in - bytes_out)}")
 
 # 失败检查
-def run_script(folder_path, keywords):
+def run_script(folder_path, keywords, dry_run=False):
     keywords = keywords if keywords else "sorry,error"
-    result = subprocess.run(
-        [
-            'python', './lib/Failed_Tagging_File_Screening.py',
-            '--image_path', folder_path,
-            '--keywords', keywords
-        ],
-        capture_output=True, text=True
-    )
-    return result.stdout if result.stdout else "No Output", result.stderr if result.stderr else "No Error"
+    if not folder_path or not os.path.isdir(folder_path):
+        return "Error: Folder does not exist. / 错误：文件夹不存在"
+    # 在进程内执行筛查，不再启动子进程
+    report = screen_failed_captions(folder_path, keywords.split(','), dry_run=dry_run)
+    return format_report(report)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Resize and compress all images in a folder to the target resolutions.")
+    parser.add_argument('folder_path', type=str, help='The path to the folder')
+    parser.add_argument('--force', action='store_true', help='Reprocess images already recorded in the manifest')
+    parser.add_argument('--processes', action='store_true', help='Use a process pool instead of threads')
+    parser.add_argument('--workers', type=int, default=None, help='Number of workers')
+    parser.add_argument('--base_resolution', type=int, default=None,
+                        help='Generate buckets for this base resolution instead of the fixed list')
+    parser.add_argument('--step', type=int, default=64, help='Bucket side multiple (32 or 64)')
+    parser.add_argument('--min_ratio', type=float, default=0.4, help='Smallest width/height ratio')
+    parser.add_argument('--max_ratio', type=float, default=2.5, help='Largest width/height ratio')
+    parser.add_argument('--format', type=str, default='JPEG', choices=['JPEG', 'WEBP', 'WEBP_LOSSLESS'],
+                        help='Output format')
+    parser.add_argument('--quality', type=int, default=95, help='Output quality')
+    parser.add_argument('--max_kb', type=int, default=0, help='Lower quality until each file fits (0 = off)')
+    parser.add_argument('--subsampling', type=str, default='4:2:0', choices=['4:4:4', '4:2:2', '4:2:0'],
+                        help='JPEG chroma subsampling')
+    parser.add_argument('--baseline', action='store_true', help='Write baseline instead of progressive JPEG')
+    args = parser.parse_args()
+
+    buckets = None
+    if args.base_resolution:
+        buckets = BucketTable(generate_buckets(args.base_resolution, args.step, args.min_ratio, args.max_ratio))
+    encoder = EncoderSettings(args.format, args.quality, args.max_kb * 1024, args.subsampling, not args.baseline)
+    print(process_images_in_folder(args.folder_path, args.processes, args.workers, args.force, buckets, encoder))
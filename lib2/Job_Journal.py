@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+JOURNAL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'batch_jobs.sqlite3')
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(JOURNAL_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                image_dir TEXT NOT NULL,
+                params TEXT,
+                created REAL NOT NULL
+            )""")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                job_id TEXT NOT NULL,
+                path TEXT NOT NULL,
+                state TEXT NOT NULL,
+                detail TEXT,
+                moved_to TEXT,
+                updated REAL,
+                PRIMARY KEY (job_id, path)
+            )""")
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_items_state ON items(job_id, state)")
+        _conn.commit()
+    return _conn
+
+
+def create_job(kind, image_dir, image_files, params=None):
+    """Record a new job with every image pending and return its id."""
+    job_id = uuid.uuid4().hex[:12]
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        conn.execute("INSERT INTO jobs (job_id, kind, image_dir, params, created) VALUES (?, ?, ?, ?, ?)",
+                     (job_id, kind, image_dir, json.dumps(params or {}), now))
+        conn.executemany("INSERT OR IGNORE INTO items (job_id, path, state, updated) VALUES (?, ?, ?, ?)",
+                         ((job_id, path, PENDING, now) for path in image_files))
+        conn.commit()
+    return job_id
+
+
+def get_job(job_id):
+    with _lock:
+        row = _connect().execute("SELECT kind, image_dir, params FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    return {"job_id": job_id, "kind": row[0], "image_dir": row[1], "params": json.loads(row[2] or "{}")}
+
+
+def pending_items(job_id, include_failed=False):
+    """Paths still to do; failed items are replayed from where they were moved when requested."""
+    states = (PENDING, FAILED) if include_failed else (PENDING,)
+    with _lock:
+        rows = _connect().execute(
+            f"SELECT path, moved_to FROM items WHERE job_id = ? AND state IN ({','.join('?' * len(states))})",
+            (job_id, *states)).fetchall()
+    items = []
+    for path, moved_to in rows:
+        if moved_to and not os.path.exists(path) and os.path.exists(moved_to):
+            items.append(moved_to)
+        else:
+            items.append(path)
+    return items
+
+
+def original_path(job_id, path):
+    """The item's original path when path is where it was moved to, otherwise path itself."""
+    if not job_id:
+        return path
+    with _lock:
+        row = _connect().execute("SELECT path FROM items WHERE job_id = ? AND moved_to = ? AND path != ?",
+                                 (job_id, path, path)).fetchone()
+    return row[0] if row else path
+
+
+def mark(job_id, path, state, detail=None, moved_to=None):
+    if not job_id:
+        return
+    with _lock:
+        conn = _connect()
+        cur = conn.execute("UPDATE items SET state = ?, detail = ?, moved_to = COALESCE(?, moved_to), updated = ? "
+                           "WHERE job_id = ? AND path = ?", (state, detail, moved_to, time.time(), job_id, path))
+        # 重放时路径可能已是错误目录中的位置
+        if cur.rowcount == 0:
+            conn.execute("UPDATE items SET state = ?, detail = ?, updated = ? WHERE job_id = ? AND moved_to = ?",
+                         (state, detail, time.time(), job_id, path))
+        conn.commit()
+
+
+def job_summary(job_id):
+    with _lock:
+        rows = _connect().execute("SELECT state, COUNT(*) FROM items WHERE job_id = ? GROUP BY state",
+                                  (job_id,)).fetchall()
+    counts = dict(rows)
+    return (f"Job {job_id}: done {counts.get(DONE, 0)}, failed {counts.get(FAILED, 0)}, "
+            f"pending {counts.get(PENDING, 0)}")
+
+
+def list_jobs(limit=20):
+    with _lock:
+        rows = _connect().execute("SELECT job_id, kind, image_dir, created FROM jobs ORDER BY created DESC LIMIT ?",
+                                  (limit,)).fetchall()
+    lines = []
+    for job_id, kind, image_dir, created in rows:
+        stamp = time.strftime('%Y-%m-%d %H:%M', time.localtime(created))
+        lines.append(f"[{stamp}] {kind} {image_dir} | {job_summary(job_id)}")
+    return "\n".join(lines) if lines else "No jobs recorded. / 暂无任务记录"
+
+
+def latest_job_id(kind, image_dir):
+    with _lock:
+        row = _connect().execute("SELECT job_id FROM jobs WHERE kind = ? AND image_dir = ? ORDER BY created DESC LIMIT 1",
+                                 (kind, image_dir)).fetchone()
+    return row[0] if row else None
@@ -0,0 +1,117 @@
+import math
+import time
+import threading
+
+from PIL import Image
+
+# 每个接口的限速器，以 api_url 为键；未配置的接口不限速
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# 桶容量按多少秒的额度计算，越小越平滑
+BURST_SECONDS = 5
+MAX_TOKENS = 300
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst_seconds=BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """Take `amount` now and return how long the caller must wait before using it."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def refund(self, amount):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute budget for one endpoint."""
+
+    def __init__(self, rpm=0, tpm=0):
+        self.rpm = TokenBucket(rpm) if rpm else None
+        self.tpm = TokenBucket(tpm) if tpm else None
+        # 实际用量 / 估算用量，随响应中的 usage 修正
+        self.correction = 1.0
+        self.lock = threading.Lock()
+
+    def scale(self, estimate):
+        return int(math.ceil(estimate * self.correction))
+
+    def reserve(self, tokens):
+        wait = 0.0
+        if self.rpm:
+            wait = max(wait, self.rpm.reserve(1))
+        if self.tpm:
+            wait = max(wait, self.tpm.reserve(tokens))
+        return wait
+
+    def acquire(self, tokens):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    def reconcile(self, reserved, raw_estimate, actual):
+        """Correct the TPM bucket and the estimate factor with the real `usage` of a response."""
+        if not actual:
+            return
+        if self.tpm:
+            self.tpm.refund(reserved - actual)
+        if raw_estimate:
+            with self.lock:
+                self.correction = 0.9 * self.correction + 0.1 * (actual / raw_estimate)
+
+
+def configure_rate_limit(api_url, rpm, tpm):
+    rpm = int(rpm or 0)
+    tpm = int(tpm or 0)
+    with _limiters_lock:
+        if rpm or tpm:
+            _limiters[api_url] = RateLimiter(rpm, tpm)
+        else:
+            _limiters.pop(api_url, None)
+    if rpm or tpm:
+        return f"Rate limit for {api_url}: {rpm} RPM, {tpm} TPM / 限速已设置"
+    return f"Rate limit disabled for {api_url} / 已取消限速"
+
+
+def get_limiter(api_url):
+    return _limiters.get(api_url)
+
+
+# Token 估算
+def estimate_image_tokens(image_path, quality):
+    if quality == "low":
+        return 85
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+    except Exception:
+        width, height = 2048, 2048
+    # high/auto: 先缩放至 2048 内，再把短边缩至 768，按 512 切片计算
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def estimate_request_tokens(image_path, prompt, quality, max_tokens=MAX_TOKENS):
+    # 文本约 4 字符 1 token；max_tokens 同样计入 TPM
+    return len(prompt) // 4 + estimate_image_tokens(image_path, quality) + max_tokens
@@ -0,0 +1,68 @@
+import array
+
+import numpy as np
+from scipy import sparse
+
+MEASURES = ("count", "pmi", "jaccard")
+
+
+def build_doc_tag_matrix(tag_lists, min_doc_freq=1):
+    """
+    Map tags to integer ids and build a binary documents × tags CSR matrix.
+    Tags occurring in fewer than min_doc_freq documents are dropped.
+    """
+    vocab = {}
+    # array 比 list 紧凑，百万级文件时内存更可控
+    indices = array.array('i')
+    indptr = array.array('q', [0])
+    for tags in tag_lists:
+        for tag in set(tags):
+            indices.append(vocab.setdefault(tag, len(vocab)))
+        indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), np.frombuffer(indices, dtype=np.int32),
+                                np.frombuffer(indptr, dtype=np.int64)), shape=(len(indptr) - 1, len(vocab)))
+    names = np.empty(len(vocab), dtype=object)
+    for tag, index in vocab.items():
+        names[index] = tag
+
+    if min_doc_freq > 1:
+        keep = np.flatnonzero(np.asarray(matrix.sum(axis=0)).ravel() >= min_doc_freq)
+        matrix = matrix[:, keep]
+        names = names[keep]
+    return list(names), matrix
+
+
+def top_cooccurrences(tag_lists, top_n, measure="count", min_doc_freq=1, min_pair_count=1):
+    """
+    Top tag pairs as [((tag1, tag2), score, count)], using a sparse XᵀX product.
+    measure: "count" (documents containing both), "pmi" or "jaccard".
+    """
+    if measure not in MEASURES:
+        raise ValueError(f"Unsupported co-occurrence measure: {measure}")
+    names, matrix = build_doc_tag_matrix(tag_lists, min_doc_freq)
+    if matrix.shape[1] < 2 or top_n <= 0:
+        return []
+
+    # 只保留上三角，(a,b) 与 (b,a) 只计一次
+    product = sparse.triu(matrix.T.tocsr() @ matrix, k=1).tocoo()
+    rows, cols, counts = product.row, product.col, product.data.astype(np.float64)
+    if min_pair_count > 1:
+        mask = counts >= min_pair_count
+        rows, cols, counts = rows[mask], cols[mask], counts[mask]
+    if len(counts) == 0:
+        return []
+
+    doc_freq = np.asarray(matrix.sum(axis=0), dtype=np.float64).ravel()
+    if measure == "pmi":
+        scores = np.log(counts * matrix.shape[0] / (doc_freq[rows] * doc_freq[cols]))
+    elif measure == "jaccard":
+        scores = counts / (doc_freq[rows] + doc_freq[cols] - counts)
+    else:
+        scores = counts
+
+    # 部分选择取前 N，再对这 N 个排序
+    top_n = min(int(top_n), len(scores))
+    selected = np.argpartition(-scores, top_n - 1)[:top_n]
+    selected = selected[np.lexsort((-counts[selected], -scores[selected]))]
+    return [((names[rows[i]], names[cols[i]]), float(scores[i]), int(counts[i])) for i in selected]
@@ -0,0 +1,159 @@
+import os
+import json
+import threading
+import collections
+import concurrent.futures
+
+from lib2.Dataset_Index import open_index
+
+# 索引保存在 Tag_analysis 目录下，与词云/网络图放在一起
+INDEX_DIR = "Tag_analysis"
+INDEX_NAME = "tag_corpus.json"
+READ_WORKERS = 16
+
+_corpora = {}
+_corpora_lock = threading.Lock()
+
+
+def parse_tags(content):
+    return [tag.strip() for tag in content.split(',') if tag.strip()]
+
+
+def _read_tags(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return parse_tags(f.read())
+
+
+class TagCorpus:
+    """
+    All caption files of a folder loaded once: per-file tag lists, global tag counts
+    and document frequencies. Persisted with file mtimes so reopening only re-reads
+    captions that changed.
+    """
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.files = {}  # rel_path -> {"mtime", "size", "tags"}
+        self.counts = collections.Counter()
+        self.doc_freq = collections.Counter()
+        self.lock = threading.RLock()
+
+    @classmethod
+    def open(cls, folder_path):
+        """Shared corpus for the folder, refreshed against the files on disk."""
+        key = os.path.realpath(folder_path)
+        with _corpora_lock:
+            corpus = _corpora.get(key)
+            if corpus is None:
+                corpus = cls(folder_path)
+                corpus.load()
+                _corpora[key] = corpus
+        corpus.refresh()
+        return corpus
+
+    def index_path(self):
+        return os.path.join(self.folder_path, INDEX_DIR, INDEX_NAME)
+
+    def load(self):
+        path = self.index_path()
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading tag index {path}, rebuilding: {e}")
+            return
+        with self.lock:
+            self.files = {rel: {"mtime": mtime, "size": size, "tags": tags}
+                          for rel, (mtime, size, tags) in data.get("files", {}).items()}
+            self._recount()
+
+    def save(self):
+        path = self.index_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            data = {"files": {rel: [entry["mtime"], entry["size"], entry["tags"]]
+                              for rel, entry in self.files.items()}}
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def refresh(self):
+        """Re-read new or modified caption files in parallel and drop deleted ones."""
+        seen = {}
+        # 文件列表来自共享数据集索引；内容可能被原地改写，仍逐个 stat
+        for file_path in open_index(self.folder_path).captions():
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            seen[os.path.relpath(file_path, self.folder_path)] = (stat.st_mtime, stat.st_size)
+
+        with self.lock:
+            stale = [rel for rel, (mtime, size) in seen.items()
+                     if rel not in self.files or self.files[rel]["mtime"] != mtime or self.files[rel]["size"] != size]
+            removed = [rel for rel in self.files if rel not in seen]
+
+        paths = [os.path.join(self.folder_path, rel) for rel in stale]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+            results = list(executor.map(self._safe_read, paths))
+
+        with self.lock:
+            for rel in removed:
+                del self.files[rel]
+            for rel, tags in zip(stale, results):
+                if tags is not None:
+                    mtime, size = seen[rel]
+                    self.files[rel] = {"mtime": mtime, "size": size, "tags": tags}
+            self._recount()
+        if stale or removed:
+            self.save()
+        return len(stale), len(removed)
+
+    @staticmethod
+    def _safe_read(file_path):
+        try:
+            return _read_tags(file_path)
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Error reading caption file {file_path}: {e}")
+            return None
+
+    def _recount(self):
+        self.counts = collections.Counter()
+        self.doc_freq = collections.Counter()
+        for entry in self.files.values():
+            self.counts.update(entry["tags"])
+            self.doc_freq.update(set(entry["tags"]))
+
+    def update_file(self, rel_path, tags):
+        """Replace a file's tags after it was rewritten, keeping counts in step."""
+        file_path = os.path.join(self.folder_path, rel_path)
+        stat = os.stat(file_path)
+        with self.lock:
+            old = self.files.get(rel_path)
+            if old is not None:
+                self.counts.subtract(old["tags"])
+                self.doc_freq.subtract(set(old["tags"]))
+            self.files[rel_path] = {"mtime": stat.st_mtime, "size": stat.st_size, "tags": tags}
+            self.counts.update(tags)
+            self.doc_freq.update(set(tags))
+            # 去掉计数归零的标签
+            self.counts += collections.Counter()
+            self.doc_freq += collections.Counter()
+
+    def items(self):
+        """(rel_path, tags) pairs; a snapshot safe to iterate while files are being updated."""
+        with self.lock:
+            return [(rel, entry["tags"]) for rel, entry in self.files.items()]
+
+    def tag_lists(self):
+        with self.lock:
+            return [entry["tags"] for entry in self.files.values()]
+
+    def top_tags(self, top_n):
+        with self.lock:
+            return self.counts.most_common(int(top_n))
+
+    def __len__(self):
+        return len(self.files)
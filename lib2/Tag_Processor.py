@@ -1,13 +1,16 @@
 import os
-import collections
 import random
+import tempfile
+import concurrent.futures
 
 import matplotlib.pyplot as plt
 import networkx as nx
 
 from wordcloud import WordCloud
-from itertools import combinations
 from lib2 import Translator
+from lib2.Tag_Corpus import TagCorpus
+from lib2.Tag_Cooccurrence import top_cooccurrences
+from lib2.Graph_Layout import compute_layout, CACHE_NAME
 
 
 def unique_elements(original, addition):
@@ -32,75 +35,118 @@ def save_path(folder_path,file_name):
     save_path = os.path.join(n_path, file_name)
     return save_path
 
-def modify_tags_in_folder(folder_path, tags_to_remove, tags_to_replace_dict, new_tag, insert_position):
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if file.endswith('.txt'):
-                file_path = os.path.join(root, file)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    tags = [tag.strip() for tag in content.split(',')]
-                # 删除标签
-                tags = [tag for tag in tags if tag not in tags_to_remove]
-                # 替换标签
-                for old_tag, new_tag_replacement in tags_to_replace_dict.items():
-                    tags = [new_tag_replacement if tag == old_tag else tag for tag in tags]
-                # 添加标签
-                if new_tag and new_tag.strip(): 
-                    if insert_position == 'Start / 开始':
-                        tags.insert(0, new_tag.strip())
-                    elif insert_position == 'End / 结束':
-                        tags.append(new_tag.strip())
-                    elif insert_position == 'Random / 随机':
-                        random_index = random.randrange(len(tags)+1)
-                        tags.insert(random_index, new_tag.strip())
-                
-                # 保存修改后的文件
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    updated_content = ', '.join(tags)
-                    f.write(updated_content)
-                    
-    return "Tags modified successfully."
+WRITE_WORKERS = 16
+
+def atomic_write(file_path, content):
+    """Write through a temp file in the same directory, so a crash never leaves a half-written caption."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        # mkstemp 创建的文件权限为 0600，沿用原文件权限
+        if os.path.exists(file_path):
+            os.chmod(tmp_path, os.stat(file_path).st_mode & 0o777)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def compile_tag_rewrites(tags_to_remove, tags_to_replace_dict):
+    """
+    One lookup table for removals and replacements: tag -> new tag, or None to drop it.
+    Replacements are applied in order, so chains such as a:b, b:c resolve to a -> c.
+    """
+    rewrites = {tag: None for tag in tags_to_remove}
+    for old_tag in tags_to_replace_dict:
+        if old_tag in rewrites:
+            continue
+        tag = old_tag
+        for pair_old, pair_new in tags_to_replace_dict.items():
+            if tag == pair_old:
+                tag = pair_new
+        rewrites[old_tag] = tag
+    return rewrites
+
+def modify_tags_in_folder(folder_path, tags_to_remove, tags_to_replace_dict, new_tag, insert_position, corpus=None,
+                          dry_run=False):
+    corpus = corpus or TagCorpus.open(folder_path)
+    rewrites = compile_tag_rewrites(tags_to_remove, tags_to_replace_dict)
+    new_tag = new_tag.strip() if new_tag else ""
+
+    changes = []
+    removed, replaced, added = 0, 0, 0
+    for rel_path, original_tags in corpus.items():
+        tags = []
+        # 删除及替换标签
+        for tag in original_tags:
+            if tag not in rewrites:
+                tags.append(tag)
+            elif rewrites[tag] is None:
+                removed += 1
+            else:
+                tags.append(rewrites[tag])
+                replaced += rewrites[tag] != tag
+        # 添加标签
+        if new_tag:
+            added += 1
+            if insert_position == 'Start / 开始':
+                tags.insert(0, new_tag)
+            elif insert_position == 'End / 结束':
+                tags.append(new_tag)
+            elif insert_position == 'Random / 随机':
+                random_index = random.randrange(len(tags)+1)
+                tags.insert(random_index, new_tag)
+
+        # 未变化的文件不重写
+        if tags != original_tags:
+            changes.append((rel_path, tags))
+
+    summary = (f"{len(changes)} of {len(corpus)} files, {removed} tags removed, {replaced} replaced, {added} added"
+               f" / {len(changes)} 个文件，删除 {removed}，替换 {replaced}，添加 {added}")
+    if dry_run:
+        return "Dry run, nothing written / 试运行，未写入: " + summary
+
+    # 保存修改后的文件
+    def write(change):
+        rel_path, tags = change
+        try:
+            atomic_write(os.path.join(folder_path, rel_path), ', '.join(tags))
+            return True
+        except OSError as e:
+            print(f"Error writing caption file {rel_path}: {e}")
+            return False
+
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+        for (rel_path, tags), ok in zip(changes, executor.map(write, changes)):
+            if ok:
+                corpus.update_file(rel_path, tags)
+            else:
+                failed += 1
+
+    corpus.save()
+    if failed:
+        return f"Tags modified with {failed} write errors: " + summary
+    return "Tags modified successfully: " + summary
 
 
 # 词云
-def count_tags_in_folder(folder_path, top_n):
-    tags_counter = collections.Counter()
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if file.endswith('.txt'):
-                file_path = os.path.join(root, file)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    tags = content.split(',')
-                    tags = [tag.strip() for tag in tags]
-                    tags_counter.update(tags)
-
-    sorted_tags = sorted(tags_counter.items(), key=lambda x: x[1], reverse=True)
-    return sorted_tags[:top_n]
-
-def generate_network_graph(folder_path, top_n):
+def count_tags_in_folder(folder_path, top_n, corpus=None):
+    corpus = corpus or TagCorpus.open(folder_path)
+    return corpus.top_tags(top_n)
+
+def generate_network_graph(folder_path, top_n, corpus=None, measure="count", layout="auto", dpi=300):
+    corpus = corpus or TagCorpus.open(folder_path)
     G = nx.Graph()
-    tags_cooccurrence = collections.defaultdict(int)
-
-    # 读取文件并计算标签的共现关系
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if file.endswith('.txt'):
-                file_path = os.path.join(root, file)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    tags = list(set(content.split(',')))  # 去重
-                    for tag_pair in combinations(tags, 2):
-                        if tag_pair[0].strip() and tag_pair[1].strip():  # 确保标签不是空的
-                            tags_cooccurrence[tag_pair] += 1
-
-    # 只考虑top n个共现关系
-    top_cooccurrences = sorted(tags_cooccurrence.items(), key=lambda x: x[1], reverse=True)[:top_n]
-
-    # 添加边到图中
-    for (tag1, tag2), weight in top_cooccurrences:
-        G.add_edge(tag1.strip(), tag2.strip(), weight=weight)
+
+    # 稀疏矩阵计算共现关系，只考虑top n个；PMI/Jaccard 忽略只共现一两次的偶然组合
+    min_pair_count = 1 if measure == "count" else 3
+    edges = top_cooccurrences(corpus.tag_lists(), top_n, measure, min_pair_count=min_pair_count)
+
+    # 添加边到图中，边宽仍按共现次数
+    for (tag1, tag2), score, weight in edges:
+        G.add_edge(tag1, tag2, weight=weight, score=score)
 
     # 设置画布大小
     plt.figure(figsize=(24, 12))
@@ -118,9 +164,8 @@ def generate_network_graph(folder_path, top_n):
     # 为边设置宽度
     edge_width = [G[u][v]['weight'] / 100 for u, v in G.edges]  # 除以10是为了使边宽度合适
 
-    # 计算节点的布局
-    pos = nx.kamada_kawai_layout(G)
-    # pos = nx.spring_layout(G, k=0.5, iterations=50)
+    # 计算节点的布局；相同边集复用缓存，少量修改时基于上次布局热启动
+    pos = compute_layout(G, layout, save_path(folder_path, CACHE_NAME))
 
     # 绘制节点，使用Plasma配色方案，以适配黑色背景
     nx.draw_networkx_nodes(G, pos, node_size=node_size,
@@ -139,12 +184,12 @@ def generate_network_graph(folder_path, top_n):
     
     # 保存图像
     save_network = save_path(folder_path,'tag_network.png')
-    plt.savefig(save_network, format='png', dpi=300, bbox_inches='tight', facecolor=gradio_blue)
+    plt.savefig(save_network, format='png', dpi=int(dpi), bbox_inches='tight', facecolor=gradio_blue)
     plt.close()
     return save_network
 
-def generate_wordcloud(folder_path, top):
-    tag_counts = count_tags_in_folder(folder_path, top)
+def generate_wordcloud(folder_path, top, corpus=None):
+    tag_counts = count_tags_in_folder(folder_path, top, corpus)
     wordcloud = WordCloud(width=1600, height=1200, background_color='white')
     wordcloud.generate_from_frequencies(dict(tag_counts))
     plt.figure(figsize=(20, 15))
@@ -182,7 +227,7 @@ def modify_file_content(file_path, new_content, mode):
             raise ValueError("Invalid mode. Must be 'overwrite/覆盖', 'prepend/前置插入', or 'append/末尾追加'.")
 
 def process_tags(folder_path, top_n, tags_to_remove, tags_to_replace, new_tag, insert_position, translate, api_key,
-                 api_url):
+                 api_url, graph_measure="count", graph_layout="auto", graph_dpi=300, dry_run=False):
     # 解析删除标签
     tags_to_remove_list = tags_to_remove.split(',') if tags_to_remove else []
     tags_to_remove_list = [tag.strip() for tag in tags_to_remove_list]
@@ -195,22 +240,26 @@ def process_tags(folder_path, top_n, tags_to_remove, tags_to_replace, new_tag, i
                 old_tag, new_replacement_tag = pair.split(':')
                 tags_to_replace_dict[old_tag.strip()] = new_replacement_tag.strip()
         except ValueError:
-            return "Error: Tags to replace must be in 'old_tag:new_tag' format separated by commas", None, None
+            return None, None, None, "Error: Tags to replace must be in 'old_tag:new_tag' format separated by commas"
+
+    # 一次性载入所有标签文件，后续步骤均使用该索引
+    corpus = TagCorpus.open(folder_path)
 
     # 修改文件夹中的标签
-    modify_tags_in_folder(folder_path, tags_to_remove_list, tags_to_replace_dict, new_tag, insert_position)
+    modify_message = modify_tags_in_folder(folder_path, tags_to_remove_list, tags_to_replace_dict, new_tag,
+                                           insert_position, corpus, dry_run)
 
     # 词云及网格图
     top = int(top_n)
-    wordcloud_path = generate_wordcloud(folder_path, top)
-    networkgraph_path = generate_network_graph(folder_path, top)
+    wordcloud_path = generate_wordcloud(folder_path, top, corpus)
+    networkgraph_path = generate_network_graph(folder_path, top, corpus, graph_measure, graph_layout, graph_dpi)
 
     # 翻译Tag功能
     def truncate_tag(tag, max_length=30): 
         # 截断过长标签
         return (tag[:max_length] + '...') if len(tag) > max_length else tag
 
-    tag_counts = count_tags_in_folder(folder_path, top)
+    tag_counts = count_tags_in_folder(folder_path, top, corpus)
 
     if translate.startswith('GPT-3.5 translation / GPT3.5翻译'):
         translator = Translator.GPTTranslator(api_key, api_url)
@@ -229,4 +278,4 @@ def process_tags(folder_path, top_n, tags_to_remove, tags_to_replace, new_tag, i
     else:
         tag_counts_with_translation = [(truncate_tag(tag), count, "") for tag, count in tag_counts]
 
-    return tag_counts_with_translation, wordcloud_path, networkgraph_path, "Tags processed successfully."
+    return tag_counts_with_translation, wordcloud_path, networkgraph_path, modify_message
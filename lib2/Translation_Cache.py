@@ -0,0 +1,94 @@
+import os
+import csv
+import time
+import sqlite3
+import threading
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'translation_cache.sqlite3')
+EXPORT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'translation_cache.csv')
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                backend TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (backend, tag)
+            )""")
+        _conn.commit()
+    return _conn
+
+
+def get_many(backend, tags):
+    """{tag: translation} for the tags already stored for this backend."""
+    found = {}
+    tags = list(dict.fromkeys(tags))
+    with _lock:
+        conn = _connect()
+        # 分批查询，避免超过 SQLite 参数个数上限
+        for start in range(0, len(tags), 500):
+            chunk = tags[start:start + 500]
+            rows = conn.execute(
+                f"SELECT tag, translation FROM translations WHERE backend = ? AND tag IN ({','.join('?' * len(chunk))})",
+                (backend, *chunk)).fetchall()
+            found.update(rows)
+    return found
+
+
+def put_many(backend, translations):
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        conn.executemany("INSERT OR REPLACE INTO translations (backend, tag, translation, updated) VALUES (?, ?, ?, ?)",
+                         ((backend, tag, text, now) for tag, text in translations.items()))
+        conn.commit()
+
+
+def export_csv(path=None):
+    path = path or EXPORT_PATH
+    with _lock:
+        rows = _connect().execute("SELECT backend, tag, translation FROM translations ORDER BY backend, tag").fetchall()
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["backend", "tag", "translation"])
+        writer.writerows(rows)
+    return f"Exported {len(rows)} translations to {path} / 已导出"
+
+
+def import_csv(path=None):
+    path = path or EXPORT_PATH
+    if not os.path.exists(path):
+        return f"Error: file not found: {path} / 错误：文件不存在"
+    by_backend = {}
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            if row.get("backend") and row.get("tag") and row.get("translation"):
+                by_backend.setdefault(row["backend"], {})[row["tag"]] = row["translation"]
+    for backend, translations in by_backend.items():
+        put_many(backend, translations)
+    return f"Imported {sum(map(len, by_backend.values()))} translations from {path} / 已导入"
+
+
+def clear():
+    with _lock:
+        conn = _connect()
+        conn.execute("DELETE FROM translations")
+        conn.commit()
+    return cache_stats()
+
+
+def cache_stats():
+    with _lock:
+        rows = _connect().execute("SELECT backend, COUNT(*) FROM translations GROUP BY backend").fetchall()
+    if not rows:
+        return "Translation cache is empty. / 翻译缓存为空"
+    return ", ".join(f"{backend}: {count}" for backend, count in rows)
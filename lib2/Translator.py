@@ -1,9 +1,15 @@
+import json
+
 import requests
-from urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from lib2.Http_Client import get_session
+from lib2 import Translation_Cache
+
 class ChineseTranslator:
+    # 翻译缓存按后端区分
+    backend = "free"
+
     def __init__(self):
         self.client = requests.Session()
 
@@ -34,17 +40,17 @@ class ChineseTranslator:
     def close_session(self):
         self.client.close()
         
-class GPTTranslator:
-    def __init__(self, api_key, api_url):
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
+# 批量翻译：每个请求的标签数、缺失标签的重试轮数、并发请求数
+BATCH_SIZE = 200
+BATCH_ROUNDS = 3
+BATCH_WORKERS = 4
 
-        self.session = requests.Session()
-        retries = Retry(total=5, backoff_factor=0.1, status_forcelist=[429, 500, 502, 503, 504])
-        self.session.mount('https://', HTTPAdapter(max_retries=retries))
+class GPTTranslator:
+    backend = "gpt-3.5-turbo"
 
+    def __init__(self, api_key, api_url):
+        # 与打标共用进程级连接池
+        self.session = get_session(api_url, api_key)
         self.api_url = api_url
 
     def translate(self, text):
@@ -54,7 +60,7 @@ class GPTTranslator:
                 {"role": "user", "content": f"你是一个英译中专家，请直接返回'{text}'最有可能的三种中文翻译结果，彼此间语义有所区分，结果以逗号间隔."}
             ]
         }
-        response = self.session.post(self.api_url, headers=self.headers, json=data)
+        response = self.session.post(self.api_url, json=data)
         response_data = response.json()
 
         if response.status_code == 200 and 'choices' in response_data and 'content' in response_data['choices'][0]['message']:
@@ -62,18 +68,86 @@ class GPTTranslator:
         else:
             return f"Error or no translation for tag: {text}"
 
+    def _request_batch(self, tags):
+        data = {
+            "model": "gpt-3.5-turbo",
+            "messages": [
+                {"role": "user", "content": "你是一个英译中专家。对下面 JSON 数组中的每个标签，给出最有可能的三种中文翻译结果，"
+                                            "彼此间语义有所区分，结果以逗号间隔。只返回一个 JSON 对象，键为原标签（保持原样），"
+                                            "值为翻译结果字符串。\n" + json.dumps(tags, ensure_ascii=False)}
+            ]
+        }
+        try:
+            response = self.session.post(self.api_url, json=data)
+            content = response.json()['choices'][0]['message']['content']
+        except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+            print(f"Batch translation request failed: {e}")
+            return {}
+        # 去掉可能的代码块标记，截取 JSON 对象部分
+        start, end = content.find('{'), content.rfind('}')
+        try:
+            mapping = json.loads(content[start:end + 1]) if start != -1 else {}
+        except ValueError:
+            print("Batch translation returned invalid JSON")
+            return {}
+        result = {}
+        for tag, text in mapping.items():
+            if isinstance(text, list):
+                text = ", ".join(map(str, text))
+            if isinstance(text, str) and text.strip():
+                result[tag] = text.strip()
+        return result
+
+    def translate_batch(self, tags):
+        """
+        Translate many tags with one request per BATCH_SIZE tags, asking for a JSON mapping.
+        Tags missing from a reply are re-queued for up to BATCH_ROUNDS rounds; returns {tag: translation}.
+        """
+        translations = {}
+        pending = list(dict.fromkeys(tags))
+        for _ in range(BATCH_ROUNDS):
+            if not pending:
+                break
+            batches = [pending[i:i + BATCH_SIZE] for i in range(0, len(pending), BATCH_SIZE)]
+            with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as executor:
+                for batch, result in zip(batches, executor.map(self._request_batch, batches)):
+                    translations.update({tag: result[tag] for tag in batch if tag in result})
+            pending = [tag for tag in pending if tag not in translations]
+        return translations
+
     def close_session(self):
-        self.session.close()
+        # 共享会话由 Http_Client 管理，这里不关闭
+        pass
         
-def translate_tags(translator, tags):
-    translations = [None] * len(tags)
+def is_valid_translation(text):
+    return bool(text) and not text.startswith("Error or no translation")
+
+def translate_tags(translator, tags, use_cache=True):
+    # 先查持久化缓存，只翻译未命中的标签
+    cached = Translation_Cache.get_many(translator.backend, tags) if use_cache else {}
+    translations = [cached.get(tag) for tag in tags]
+    misses = [i for i, tag in enumerate(tags) if tag not in cached]
     
-    with ThreadPoolExecutor(max_workers=50) as executor:
-        future_to_index = {executor.submit(translator.translate, tag): i for i, tag in enumerate(tags)}
-        for future in as_completed(future_to_index):
-            index = future_to_index[future]
-            translations[index] = future.result()
-            
+    if misses and hasattr(translator, "translate_batch"):
+        # 批量翻译，多轮后仍缺失的标签再逐个翻译
+        batch_result = translator.translate_batch([tags[i] for i in misses])
+        for i in misses:
+            translations[i] = batch_result.get(tags[i])
+        remaining = [i for i in misses if tags[i] not in batch_result]
+    else:
+        remaining = misses
+
+    if remaining:
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            future_to_index = {executor.submit(translator.translate, tags[i]): i for i in remaining}
+            for future in as_completed(future_to_index):
+                index = future_to_index[future]
+                translations[index] = future.result()
+
     translator.close_session()
+
+    if use_cache:
+        Translation_Cache.put_many(translator.backend, {tags[i]: translations[i] for i in misses
+                                                        if is_valid_translation(translations[i])})
             
     return translations
@@ -2,21 +2,37 @@
 import os
 import shutil
 import threading
+import collections
 
 import concurrent.futures
 from tqdm import tqdm
 
 from modules import script_callbacks
 
-from lib2.Img_Processing import process_images_in_folder, run_script
+from lib2.Img_Processing import process_images_in_folder, run_script, DEFAULT_BUCKETS
+from lib2.Bucketing import bucket_table_from_settings, bucket_histogram
+from lib2.Image_Encoder import EncoderSettings
+from lib2.Image_Metadata import metadata_report
 from lib2.Tag_Processor import modify_file_content, process_tags
 from lib2.GPT_Prompt import get_prompts_from_csv, save_prompt, delete_prompt
-from lib2.Api_Utils import run_openai_api, save_api_details, get_api_details, save_state, qwen_api_switch
+from lib2.Api_Utils import run_openai_api, run_openai_api_batch, run_multi_task_api, is_error_caption, save_api_details, \
+    get_api_details, save_state, qwen_api_switch, DEFAULT_WATERMARK_QUESTION
+from lib2.Http_Client import configure_client
+from lib2 import Caption_Cache
+from lib2 import Translation_Cache
+from lib2.Concurrency import start_controller, concurrency_status
+from lib2.Rate_Limiter import configure_rate_limit
+from lib2 import Job_Journal
+from lib2 import Dataset_Index
+from lib2 import Dedup
+from lib2 import Batch_Progress
+from lib2.Batch_Progress import stream_batch
+from lib2.Batch_Api import OpenAIBatchTransport, base_url_from_api_url, default_out_dir, export_batch_jsonl, \
+    submit_batches, poll_and_ingest
 
 
 os.environ["GRADIO_ANALYTICS_ENABLED"] = "False"
 mod_default, saved_api_key, saved_api_url = get_api_details()
-SUPPORTED_IMAGE_FORMATS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif', '.tiff', '.tif')
 
 # 图像打标
 should_stop = threading.Event()
@@ -30,16 +46,97 @@ def process_single_image(api_key, prompt, api_url, image_path, quality, timeout)
     print(caption)
     return caption
 
-def process_batch_images(api_key, prompt, api_url, image_dir, file_handling_mode, quality, timeout):
+def call_api(controller, image_path, prompt, api_key, api_url, quality, timeout, use_cache):
+    if controller is None:
+        return run_openai_api(image_path, prompt, api_key, api_url, quality, timeout, use_cache)
+    # 自适应并发：限流由控制器处理，连接层不再对429/503重试
+    return controller.call(run_openai_api, image_path, prompt, api_key, api_url, quality, timeout, use_cache,
+                           retry_throttled=False)
+
+def list_images(image_dir):
+    # 共享数据集索引，只重新列出有变化的目录
+    return Dataset_Index.open_index(image_dir).images()
+
+# 任务日志：新任务记录全部图片，续跑时只取未完成(及失败)项
+def prepare_job(kind, image_dir, job_id, retry_failed, params=None):
+    job_id = (job_id or "").strip()
+    if job_id:
+        job = Job_Journal.get_job(job_id)
+        if job is None:
+            raise ValueError(f"Unknown job ID: {job_id} / 未找到任务")
+        # 续跑的任务必须属于当前页面和目录
+        if job["kind"] != kind:
+            raise ValueError(f"Job {job_id} is a {job['kind']} job, not {kind} / 任务类型不符")
+        if image_dir and os.path.realpath(job["image_dir"]) != os.path.realpath(image_dir):
+            raise ValueError(f"Job {job_id} belongs to {job['image_dir']} / 任务目录不符")
+        return job_id, Job_Journal.pending_items(job_id, retry_failed)
+    image_files = list_images(image_dir)
+    return Job_Journal.create_job(kind, image_dir, image_files, params), image_files
+
+def run_async_batch(image_files, prompt, api_key, api_url, quality, timeout, concurrency, handle_caption,
+                    use_cache=True):
+    from lib2.Async_Api import caption_images_async
+
+    results = []
+    progress = tqdm(total=len(image_files), desc="Processing images")
+
+    def on_result(image_path, caption):
+        results.append(handle_caption(image_path, caption))
+        progress.update(1)
+
+    try:
+        caption_images_async(image_files, prompt, api_key, api_url, quality, timeout,
+                             concurrency=concurrency, on_result=on_result, should_stop=should_stop,
+                             use_cache=use_cache)
+    finally:
+        progress.close()
+    if should_stop.is_set():
+        print("Batch processing was stopped by the user.")
+    return results
+
+def process_batch_images(api_key, prompt, api_url, image_dir, file_handling_mode, quality, timeout,
+                         use_async=False, concurrency=256, use_cache=True, adaptive=False, job_id="",
+                         retry_failed=False, images_per_request=1, dedup_mode="off", dedup_threshold=4,
+                         batch_progress=None):
+    """Caption every image in image_dir; returns (job_id, results)."""
     should_stop.clear()
+    batch_progress = batch_progress or Batch_Progress.BatchProgress()
     save_api_details(api_key, api_url)
     results = []
 
-    image_files = []
-    for root, dirs, files in os.walk(image_dir):
-        for file in files:
-            if file.lower().endswith(SUPPORTED_IMAGE_FORMATS):
-                image_files.append(os.path.join(root, file))
+    job_id, image_files = prepare_job("caption", image_dir, job_id, retry_failed,
+                                      {"prompt": prompt, "quality": quality, "mode": file_handling_mode})
+    batch_progress.start(len(image_files))
+
+    # 近重复图像：只为代表图打标，其余跳过或复制代表图的标签
+    duplicates = {}
+    if dedup_mode != "off":
+        clusters = Dedup.find_duplicate_clusters(image_files, dedup_threshold)
+        duplicates = Dedup.duplicate_map(clusters)
+        if clusters:
+            report_path = Dedup.save_cluster_report(
+                clusters, os.path.join(os.path.dirname(os.path.abspath(image_dir)), "duplicate_clusters.json"))
+            print(f"{Dedup.format_clusters(clusters)}\nReport: {report_path}")
+        image_files = [filename for filename in image_files if filename not in duplicates]
+
+    def finish_duplicates():
+        for filename, representative in duplicates.items():
+            if dedup_mode == "skip":
+                Job_Journal.mark(job_id, filename, Job_Journal.DONE, f"duplicate of {representative}")
+                batch_progress.record(filename)
+                results.append((filename, f"Skipped as a duplicate of {representative}."))
+                continue
+            rep_caption_path = os.path.splitext(representative)[0] + ".txt"
+            if not os.path.exists(rep_caption_path):
+                # 代表图打标失败时保持待处理，续跑时单独打标
+                results.append((filename, f"Not captioned: {representative} has no caption."))
+                continue
+            with open(rep_caption_path, 'r', encoding='utf-8') as f:
+                caption = f.read()
+            modify_file_content(os.path.splitext(filename)[0] + ".txt", caption, file_handling_mode)
+            Job_Journal.mark(job_id, filename, Job_Journal.DONE, f"caption copied from {representative}")
+            batch_progress.record(filename, caption)
+            results.append((filename, f"Caption copied from {representative}."))
 
     def process_image(filename, file_handling_mode):
         image_path = os.path.join(image_dir, filename)
@@ -48,34 +145,120 @@ def process_batch_images(api_key, prompt, api_url, image_dir, file_handling_mode
         caption_path = os.path.join(image_dir, caption_filename)
 
         if file_handling_mode != "skip/跳过" or not os.path.exists(caption_path):
-            caption = run_openai_api(image_path, prompt, api_key, api_url, quality, timeout)
-
-            if caption.startswith("Error:") or caption.startswith("API error:"):
-                return handle_error(image_path, caption_path, caption_filename, filename)
-            else:
-                modify_file_content(caption_path, caption, file_handling_mode)
-                return filename, caption_path
+            caption = call_api(controller, image_path, prompt, api_key, api_url, quality, timeout, use_cache)
+            return handle_caption(filename, caption)
         else:
+            Job_Journal.mark(job_id, filename, Job_Journal.DONE, "skipped")
+            batch_progress.record(filename)
             return filename, "Skipped because caption file already exists."
 
-    def handle_error(image_path, caption_path, caption_filename, filename):
-        parent_dir = os.path.dirname(image_dir)
+    def handle_caption(filename, caption):
+        # 重放时 filename 是错误目录中的位置，成功后移回原路径
+        original = Job_Journal.original_path(job_id, filename)
+
+        if is_error_caption(caption):
+            batch_progress.record(filename, caption, ok=False)
+            if original != filename:
+                Job_Journal.mark(job_id, original, Job_Journal.FAILED, caption)
+                return filename, "Replay failed again; image stays in the error directory."
+            image_path = os.path.join(image_dir, filename)
+            caption_filename = f"{os.path.splitext(filename)[0]}.txt"
+            caption_path = os.path.join(image_dir, caption_filename)
+            return handle_error(image_path, caption_path, caption_filename, filename, caption)
+        else:
+            if original != filename:
+                restore_file(filename, original)
+                filename = original
+            caption_path = os.path.join(image_dir, f"{os.path.splitext(filename)[0]}.txt")
+            modify_file_content(caption_path, caption, file_handling_mode)
+            Job_Journal.mark(job_id, filename, Job_Journal.DONE)
+            batch_progress.record(filename, caption)
+            return filename, caption_path
+
+    def restore_file(moved_path, original):
+        os.makedirs(os.path.dirname(original), exist_ok=True)
+        shutil.move(moved_path, original)
+        moved_caption = os.path.splitext(moved_path)[0] + ".txt"
+        if os.path.exists(moved_caption):
+            shutil.move(moved_caption, os.path.splitext(original)[0] + ".txt")
+
+    def handle_error(image_path, caption_path, caption_filename, filename, caption):
+        parent_dir = os.path.dirname(os.path.abspath(image_dir))
         error_image_dir = os.path.join(parent_dir, "error_images")
-        if not os.path.exists(error_image_dir):
-            os.makedirs(error_image_dir)
 
-        error_image_path = os.path.join(error_image_dir, filename)
-        error_caption_path = os.path.join(error_image_dir, caption_filename)
+        # 索引返回绝对路径，按相对数据集的路径放入错误目录
+        error_image_path = os.path.join(error_image_dir, os.path.relpath(image_path, image_dir))
+        error_caption_path = os.path.splitext(error_image_path)[0] + ".txt"
+        os.makedirs(os.path.dirname(error_image_path), exist_ok=True)
 
         try:
             shutil.move(image_path, error_image_path)
             if os.path.exists(caption_path):
                 shutil.move(caption_path, error_caption_path)
+            Job_Journal.mark(job_id, filename, Job_Journal.FAILED, caption, moved_to=error_image_path)
             return filename, "Error handled and image with its caption moved to error directory."
         except Exception as e:
+            Job_Journal.mark(job_id, filename, Job_Journal.FAILED, caption)
             return filename, f"An unexpected error occurred while moving {filename} or {caption_filename}: {e}"
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+    def pending_files():
+        pending = []
+        for filename in image_files:
+            if file_handling_mode == "skip/跳过" and os.path.exists(os.path.splitext(filename)[0] + ".txt"):
+                Job_Journal.mark(job_id, filename, Job_Journal.DONE, "skipped")
+                batch_progress.record(filename)
+                results.append((filename, "Skipped because caption file already exists."))
+            else:
+                pending.append(filename)
+        return pending
+
+    if use_async:
+        results.extend(run_async_batch(pending_files(), prompt, api_key, api_url, quality, timeout, concurrency,
+                                       handle_caption, use_cache))
+        finish_duplicates()
+        print(f"Processing complete. Total images processed: {len(results)}. {Job_Journal.job_summary(job_id)}")
+        return job_id, results
+
+    # 多图合并请求
+    if images_per_request > 1:
+        pending = pending_files()
+        groups = [pending[i:i + images_per_request] for i in range(0, len(pending), images_per_request)]
+
+        def process_group(filenames):
+            image_paths = [os.path.join(image_dir, filename) for filename in filenames]
+            captions = run_openai_api_batch(image_paths, prompt, api_key, api_url, quality, timeout, use_cache)
+            return [handle_caption(filename, caption) for filename, caption in zip(filenames, captions)]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+            futures = {executor.submit(process_group, group): group for group in groups}
+            progress = tqdm(total=len(pending), desc="Processing images")
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    group = futures[future]
+                    if should_stop.is_set():
+                        for f in futures:
+                            f.cancel()
+                        print("Batch processing was stopped by the user.")
+                        break
+                    try:
+                        results.extend(future.result())
+                    except Exception as e:
+                        print(f"An exception occurred while processing {len(group)} images: {e}")
+                        for filename in group:
+                            results.append((filename, f"An exception occurred: {e}"))
+                            batch_progress.record(filename, str(e), ok=False)
+                    progress.update(len(group))
+            finally:
+                progress.close()
+                executor.shutdown(wait=False)
+
+        finish_duplicates()
+        print(f"Processing complete. Total images processed: {len(results)}. {Job_Journal.job_summary(job_id)}")
+        return job_id, results
+
+    controller = start_controller(concurrency) if adaptive else None
+    max_workers = controller.max_limit if controller else 5
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
         futures = {}
         for filename in image_files:
             future = executor.submit(process_image, filename, file_handling_mode)
@@ -95,14 +278,16 @@ def process_batch_images(api_key, prompt, api_url, image_dir, file_handling_mode
                 except Exception as e:
                     result = (filename, f"An exception occurred: {e}")
                     print(f"An exception occurred while processing {filename}: {e}")
+                    batch_progress.record(filename, str(e), ok=False)
                 results.append(result)
                 progress.update(1)
         finally:
             progress.close()
             executor.shutdown(wait=False)
 
-    print(f"Processing complete. Total images processed: {len(results)}")
-    return results
+    finish_duplicates()
+    print(f"Processing complete. Total images processed: {len(results)}. {Job_Journal.job_summary(job_id)}")
+    return job_id, results
 
 def handle_file(image_path, target_path, file_handling_mode):
     try:
@@ -115,32 +300,73 @@ def handle_file(image_path, target_path, file_handling_mode):
         return f"Error handling file {image_path}: {e}"
     return
 
+# 分类规则：(是否为包含规则, 词)
+def parse_rules(list_r):
+    rules = []
+    for i in range(0, len(list_r), 2):
+        rule_type = list_r[i]
+        rule_input = list_r[i + 1]
+        if rule_type and rule_input:
+            rule_type_bool = rule_type == "Involve / 包含"
+            rules.append((rule_type_bool, rule_input))
+    return rules
+
+def route_by_rules(paths, answer, rules, o_dir, file_handling_mode):
+    """Move/copy paths into o_dir/<matching rules joined by -> (or no_match); returns the folder name."""
+    matching_rules = []
+    for rule_bool, rule_input in rules:
+        if (rule_bool and rule_input in answer) or (not rule_bool and rule_input not in answer):
+            matching_rules.append(rule_input)
+
+    folder_name = "-".join(matching_rules) if matching_rules else "no_match"
+    target_folder = os.path.join(o_dir, folder_name)
+    os.makedirs(target_folder, exist_ok=True)
+    for path in paths:
+        handle_file(path, target_folder, file_handling_mode)
+    return folder_name
+
 def process_batch_watermark_detection(api_key, prompt, api_url, image_dir, detect_file_handling_mode, quality, timeout,
-                                      watermark_dir):
+                                      watermark_dir, use_async=False, concurrency=256, use_cache=True, adaptive=False,
+                                      job_id="", retry_failed=False, batch_progress=None):
     should_stop.clear()
+    batch_progress = batch_progress or Batch_Progress.BatchProgress()
     save_api_details(api_key, api_url)
     results = []
     prompt = 'Is image have watermark'
 
-    image_files = []
-    for root, dirs, files in os.walk(image_dir):
-        for file in files:
-            if file.lower().endswith(SUPPORTED_IMAGE_FORMATS):
-                image_files.append(os.path.join(root, file))
+    try:
+        job_id, image_files = prepare_job("watermark", image_dir, job_id, retry_failed,
+                                          {"watermark_dir": watermark_dir, "mode": detect_file_handling_mode})
+    except ValueError as e:
+        return f"Error: {e}"
+    batch_progress.start(len(image_files))
 
     def process_image(filename, detect_file_handling_mode, watermark_dir):
         image_path = os.path.join(image_dir, filename)
-        caption = run_openai_api(image_path, prompt, api_key, api_url, quality, timeout)
+        caption = call_api(controller, image_path, prompt, api_key, api_url, quality, timeout, use_cache)
+        return handle_caption(filename, caption)
 
-        if caption.startswith("Error:") or caption.startswith("API error:"):
+    def handle_caption(filename, caption):
+        if is_error_caption(caption):
+            Job_Journal.mark(job_id, filename, Job_Journal.FAILED, caption)
+            batch_progress.record(filename, caption, ok=False)
             return "error"
 
         # EOI是cog迷之误判？
         if 'Yes,' in caption and '\'EOI\'' not in caption:
             target_path = os.path.join(watermark_dir, filename)
             handle_file(filename, watermark_dir, detect_file_handling_mode)
+        Job_Journal.mark(job_id, filename, Job_Journal.DONE)
+        batch_progress.record(filename, caption)
+
+    if use_async:
+        results = run_async_batch(image_files, prompt, api_key, api_url, quality, timeout, concurrency,
+                                  handle_caption, use_cache)
+        return f"Total checked images: {len(results)}. {Job_Journal.job_summary(job_id)}"
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+    controller = start_controller(concurrency) if adaptive else None
+    max_workers = controller.max_limit if controller else 5
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
         futures = {}
         for filename in image_files:
             future = executor.submit(process_image, filename, detect_file_handling_mode, watermark_dir)
@@ -160,73 +386,69 @@ def process_batch_watermark_detection(api_key, prompt, api_url, image_dir, detec
                 except Exception as e:
                     result = (filename, f"An exception occurred: {e}")
                     print(f"An exception occurred while processing {filename}: {e}")
+                    batch_progress.record(filename, str(e), ok=False)
                 results.append(result)
                 progress.update(1)
         finally:
             progress.close()
             executor.shutdown(wait=False)
 
-    results = f"Total checked images: {len(results)}"
+    results = f"Total checked images: {len(results)}. {Job_Journal.job_summary(job_id)}"
     return results
 
-def classify_images(api_key, api_url, quality, prompt, timeout, detect_file_handling_mode, image_dir, o_dir, *list_r):
+def classify_images(api_key, api_url, quality, prompt, timeout, detect_file_handling_mode, image_dir, o_dir,
+                    use_async, concurrency, use_cache, adaptive, job_id, retry_failed, *list_r, batch_progress=None):
 
     # 初始化
     should_stop.clear()
+    batch_progress = batch_progress or Batch_Progress.BatchProgress()
     save_api_details(api_key, api_url)
     results = []
 
     # 检查输入
     if not os.path.exists(image_dir):
         return "Error: Image directory does not exist. / 错误：图片目录不存在"
+    # 先校验规则，避免无效点击留下空任务
+    rules = parse_rules(list_r)
+    if rules == []:
+        return "Error: All rules are empty. / 错误：未设置规则"
     if not o_dir:
         o_dir = os.path.join(image_dir, "classify_output")
     if not os.path.exists(o_dir):
         os.makedirs(o_dir)
 
     # 获取图像
-    image_files = []
-    for root, dirs, files in os.walk(image_dir):
-        for file in files:
-            if file.lower().endswith(SUPPORTED_IMAGE_FORMATS):
-                image_files.append(os.path.join(root, file))
-
-    # 转换列表
-    rules = []
-    for i in range(0, len(list_r), 2):
-        rule_type = list_r[i]
-        rule_input = list_r[i + 1]
-        if rule_type and rule_input:
-            rule_type_bool = rule_type == "Involve / 包含"
-            rules.append((rule_type_bool, rule_input))
-    if rules == []:
-        return "Error: All rules are empty. / 错误：未设置规则"
+    try:
+        job_id, image_files = prepare_job("classify", image_dir, job_id, retry_failed, {"output_dir": o_dir})
+    except ValueError as e:
+        return f"Error: {e}"
+    batch_progress.start(len(image_files))
 
     # 图像处理
     def process_image(filename, rules, detect_file_handling_mode, image_dir, o_dir):
         image_path = os.path.join(image_dir, filename)
-        caption = run_openai_api(image_path, prompt, api_key, api_url, quality, timeout)
+        caption = call_api(controller, image_path, prompt, api_key, api_url, quality, timeout, use_cache)
+        return handle_caption(filename, caption)
 
-        if caption.startswith("Error:") or caption.startswith("API error:"):
+    def handle_caption(filename, caption):
+        if is_error_caption(caption):
+            Job_Journal.mark(job_id, filename, Job_Journal.FAILED, caption)
+            batch_progress.record(filename, caption, ok=False)
             return "error"
 
-        matching_rules = []
-        for rule_bool, rule_input in rules:
-            if (rule_bool and rule_input in caption) or (not rule_bool and rule_input not in caption):
-                matching_rules.append(rule_input)
-        
-        if matching_rules:
-            folder_name = "-".join(matching_rules)
-            target_folder = os.path.join(o_dir, folder_name)
-            os.makedirs(target_folder, exist_ok=True)
-            handle_file(filename, target_folder, detect_file_handling_mode)
-        elif matching_rules == []:
-            no_match_folder = os.path.join(o_dir, "no_match")
-            os.makedirs(no_match_folder, exist_ok=True)
-            handle_file(filename, no_match_folder, detect_file_handling_mode)
+        route_by_rules([filename], caption, rules, o_dir, detect_file_handling_mode)
+        Job_Journal.mark(job_id, filename, Job_Journal.DONE)
+        batch_progress.record(filename, caption)
 
     # 批量处理
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+    if use_async:
+        results = run_async_batch(image_files, prompt, api_key, api_url, quality, timeout, concurrency,
+                                  handle_caption, use_cache)
+        return f"Total checked images: {len(results)}. {Job_Journal.job_summary(job_id)}"
+
+    controller = start_controller(concurrency) if adaptive else None
+    max_workers = controller.max_limit if controller else 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
         futures = {}
         for filename in image_files:
             future = executor.submit(process_image, filename, rules, detect_file_handling_mode, image_dir, o_dir)
@@ -248,6 +470,7 @@ def classify_images(api_key, api_url, quality, prompt, timeout, detect_file_hand
                 except Exception as e:
                     result = (filename, f"An exception occurred: {e}")
                     print(f"An exception occurred while processing {filename}: {e}")
+                    batch_progress.record(filename, str(e), ok=False)
                 results.append(result)
                 progress.update(1)
 
@@ -256,9 +479,150 @@ def classify_images(api_key, api_url, quality, prompt, timeout, detect_file_hand
             progress.close()
             executor.shutdown(wait=False)
 
-    results = f"Total checked images: {len(results)}"
+    results = f"Total checked images: {len(results)}. {Job_Journal.job_summary(job_id)}"
     return results
 
+def process_batch_multi_task(api_key, prompt, api_url, image_dir, file_handling_mode, quality, timeout,
+                             watermark_prompt, watermark_dir, watermark_mode, category_prompt, o_dir, classify_mode,
+                             concurrency=256, use_cache=True, adaptive=False, job_id="", retry_failed=False, *list_r,
+                             batch_progress=None):
+    """
+    Caption, watermark detection and rule classification from one request per image.
+    A watermarked image that is moved away is not classified; captions follow their image when it is moved or copied.
+    """
+    should_stop.clear()
+    batch_progress = batch_progress or Batch_Progress.BatchProgress()
+    save_api_details(api_key, api_url)
+    results = []
+
+    if not image_dir or not os.path.exists(image_dir):
+        return "Error: Image directory does not exist. / 错误：图片目录不存在"
+    if not watermark_dir:
+        # 与 error_images 一样放在数据集旁，续跑时不会被重新扫描
+        watermark_dir = os.path.join(os.path.dirname(os.path.abspath(image_dir)), "watermark_images")
+    os.makedirs(watermark_dir, exist_ok=True)
+    rules = parse_rules(list_r)
+    if rules:
+        if not o_dir:
+            o_dir = os.path.join(image_dir, "classify_output")
+        os.makedirs(o_dir, exist_ok=True)
+
+    try:
+        job_id, image_files = prepare_job("multitask", image_dir, job_id, retry_failed,
+                                          {"prompt": prompt, "quality": quality, "mode": file_handling_mode,
+                                           "watermark_dir": watermark_dir, "output_dir": o_dir})
+    except ValueError as e:
+        return f"Error: {e}"
+    batch_progress.start(len(image_files))
+
+    def process_image(filename):
+        image_path = os.path.join(image_dir, filename)
+        if controller is None:
+            result = run_multi_task_api(image_path, prompt, watermark_prompt, category_prompt, api_key, api_url,
+                                        quality, timeout, use_cache)
+        else:
+            result = controller.call(run_multi_task_api, image_path, prompt, watermark_prompt, category_prompt,
+                                     api_key, api_url, quality, timeout, use_cache, retry_throttled=False)
+        return handle_result(filename, result)
+
+    def handle_result(filename, result):
+        if isinstance(result, str):
+            Job_Journal.mark(job_id, filename, Job_Journal.FAILED, result)
+            batch_progress.record(filename, result, ok=False)
+            return filename, "error", False, None
+
+        image_path = os.path.join(image_dir, filename)
+        caption_path = os.path.splitext(image_path)[0] + ".txt"
+        modify_file_content(caption_path, result["caption"], file_handling_mode)
+        paths = [image_path] + ([caption_path] if os.path.exists(caption_path) else [])
+
+        folder_name = None
+        if result["watermark"]:
+            for path in paths:
+                handle_file(path, watermark_dir, watermark_mode)
+        if rules and not (result["watermark"] and watermark_mode[:4] == "move"):
+            # 未提分类问题时按标签匹配规则
+            folder_name = route_by_rules(paths, result["category"] or result["caption"], rules, o_dir,
+                                         classify_mode)
+        Job_Journal.mark(job_id, filename, Job_Journal.DONE)
+        batch_progress.record(filename, result["caption"])
+        return filename, caption_path, result["watermark"], folder_name
+
+    controller = start_controller(concurrency) if adaptive else None
+    max_workers = controller.max_limit if controller else 5
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(process_image, filename): filename for filename in image_files}
+        progress = tqdm(total=len(futures), desc="Processing images")
+
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                filename = futures[future]
+                if should_stop.is_set():
+                    for f in futures:
+                        f.cancel()
+                    print("Batch processing was stopped by the user.")
+                    break
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"An exception occurred while processing {filename}: {e}")
+                    batch_progress.record(filename, str(e), ok=False)
+                progress.update(1)
+        finally:
+            progress.close()
+            executor.shutdown(wait=False)
+
+    captioned = sum(1 for _, status, _, _ in results if status != "error")
+    watermarked = sum(1 for _, _, watermark, _ in results if watermark)
+    folders = collections.Counter(folder for _, _, _, folder in results if folder)
+    summary = (f"Total processed images: {len(results)}, captioned: {captioned}, watermarked: {watermarked}. "
+               f"/ 已处理 {len(results)} 张，打标 {captioned} 张，水印 {watermarked} 张")
+    if folders:
+        summary += "\nClassified / 分类: " + ", ".join(f"{name}: {n}" for name, n in folders.most_common())
+    return f"{summary}\n{Job_Journal.job_summary(job_id)}"
+
+# 图像预压缩
+def process_image_folder(folder_path, use_processes, workers, force, base_resolution, step, min_ratio, max_ratio,
+                         output_format, output_quality, max_kb, subsampling, progressive):
+    try:
+        buckets = bucket_table_from_settings(base_resolution, step, min_ratio, max_ratio)
+    except (ValueError, ZeroDivisionError) as e:
+        return f"Error: invalid bucket settings: {e} / 错误：分桶设置无效"
+    try:
+        encoder = EncoderSettings(output_format, output_quality, int(max_kb or 0) * 1024, subsampling, progressive)
+    except ValueError as e:
+        return f"Error: invalid output settings: {e} / 错误：输出设置无效"
+    return process_images_in_folder(folder_path, use_processes, workers, force, buckets, encoder)
+
+def preview_buckets(folder_path, base_resolution, step, min_ratio, max_ratio):
+    if not os.path.exists(folder_path):
+        return "Error: Image directory does not exist. / 错误：图片目录不存在"
+    try:
+        buckets = bucket_table_from_settings(base_resolution, step, min_ratio, max_ratio) or DEFAULT_BUCKETS
+    except (ValueError, ZeroDivisionError) as e:
+        return f"Error: invalid bucket settings: {e} / 错误：分桶设置无效"
+    return bucket_histogram(folder_path, buckets)
+
+# 离线 Batch API
+def batch_api_export(prompt, quality, image_dir, out_dir):
+    if not os.path.exists(image_dir):
+        return "Error: Image directory does not exist. / 错误：图片目录不存在"
+    return export_batch_jsonl(image_dir, prompt, quality, out_dir or None)
+
+def batch_api_submit(api_key, api_url, image_dir, out_dir):
+    transport = OpenAIBatchTransport(api_key, base_url_from_api_url(api_url))
+    try:
+        return submit_batches(out_dir or default_out_dir(image_dir), transport)
+    except Exception as e:
+        return f"Error submitting batch: {e}"
+
+def batch_api_poll(api_key, api_url, image_dir, out_dir, file_handling_mode):
+    transport = OpenAIBatchTransport(api_key, base_url_from_api_url(api_url))
+    try:
+        return poll_and_ingest(out_dir or default_out_dir(image_dir), transport, file_handling_mode)
+    except Exception as e:
+        return f"Error checking batch: {e}"
+
 # api
 def switch_API(api, state):
     if api[:3] == 'GPT' or api[:4] == "qwen":
@@ -273,6 +637,10 @@ def switch_API(api, state):
 
     return key, url, time_out, s_state
 
+def apply_client_settings(pool_size, keep_alive, retry_total, retry_backoff):
+    configure_client(pool_size=pool_size, keep_alive=keep_alive, retry_total=retry_total, retry_backoff=retry_backoff)
+    return f"Connection pool: {int(pool_size)}, keep-alive: {keep_alive}, retries: {int(retry_total)} / 连接池设置已更新"
+
 # SD WebUI extensions
 def on_ui_tabs():
     
@@ -298,6 +666,43 @@ def on_ui_tabs():
                                   placeholder="Enter a descriptive prompt",
                                   lines=5)
 
+        with gr.Accordion("Concurrency / 并发设置", open=False):
+            with gr.Row():
+                async_input = gr.Checkbox(label="Async Engine / 异步引擎", value=False)
+                concurrency_input = gr.Number(label="Max In-flight Requests / 最大并发请求数", value=256, step=1)
+                adaptive_input = gr.Checkbox(label="Adaptive Concurrency / 自适应并发", value=False)
+                gr.Textbox(label="Concurrency State / 并发状态", value=concurrency_status, every=1, interactive=False)
+
+        with gr.Accordion("Caption Cache / 打标缓存", open=False):
+            with gr.Row():
+                cache_input = gr.Checkbox(label="Use Caption Cache / 使用打标缓存", value=True)
+                cache_stats_output = gr.Textbox(label="Cache State / 缓存状态", interactive=False)
+                cache_stats_button = gr.Button("Refresh / 刷新")
+                cache_clear_button = gr.Button("Clear Cache / 清空缓存")
+            cache_stats_button.click(Caption_Cache.cache_stats, inputs=[], outputs=cache_stats_output)
+            cache_clear_button.click(Caption_Cache.clear, inputs=[], outputs=cache_stats_output)
+
+        with gr.Accordion("Batch Jobs / 批处理任务", open=False):
+            with gr.Row():
+                job_id_input = gr.Textbox(label="Resume Job ID / 续跑任务ID",
+                                          placeholder="Leave empty to start a new job / 留空则新建任务")
+                retry_failed_input = gr.Checkbox(label="Replay Failed Items / 重试失败项", value=False)
+                list_jobs_button = gr.Button("List Jobs / 任务列表")
+            jobs_output = gr.Textbox(label="Jobs / 任务", lines=5, interactive=False)
+            list_jobs_button.click(Job_Journal.list_jobs, inputs=[], outputs=jobs_output)
+
+        with gr.Accordion("Dataset Index / 数据集索引", open=False):
+            with gr.Row():
+                index_folder_input = gr.Textbox(label="Dataset Folder / 数据集目录",
+                                                placeholder="Enter the directory path / 输入目录路径")
+                index_stats_button = gr.Button("Scan / 扫描")
+                index_watch_button = gr.Button("Watch / 监视变化")
+                index_unwatch_button = gr.Button("Stop Watching / 停止监视")
+            index_output = gr.Textbox(label="Index State / 索引状态", interactive=False)
+            index_stats_button.click(Dataset_Index.index_stats, inputs=[index_folder_input], outputs=index_output)
+            index_watch_button.click(Dataset_Index.start_watch, inputs=[index_folder_input], outputs=index_output)
+            index_unwatch_button.click(Dataset_Index.stop_watch, inputs=[index_folder_input], outputs=index_output)
+
         with gr.Accordion("Prompt Saving / 提示词存档", open=False):
             def update_textbox(prompt):
                 return prompt
@@ -321,13 +726,32 @@ def on_ui_tabs():
                         placeholder="Enter the folder path containing images / 输入包含图像的文件夹路径"
                     )
                     process_images_button = gr.Button("Process Images / 压缩图像")
+                with gr.Row():
+                    process_pool_input = gr.Checkbox(label="Process Pool / 多进程处理", value=False)
+                    process_workers_input = gr.Number(label="Workers (0 = auto) / 进程数（0为自动）", value=0, step=1)
+                    force_process_input = gr.Checkbox(label="Force Reprocess All / 强制全部重新处理", value=False)
+                with gr.Row():
+                    bucket_base_input = gr.Dropdown(["Default", "512", "768", "1024", "1280", "1536"], value="Default",
+                                                    label="Bucket Base Resolution / 分桶基准分辨率")
+                    bucket_step_input = gr.Dropdown(["32", "64"], value="64", label="Bucket Step / 边长倍数")
+                    bucket_min_ratio_input = gr.Number(label="Min Aspect (W/H) / 最小宽高比", value=0.4)
+                    bucket_max_ratio_input = gr.Number(label="Max Aspect (W/H) / 最大宽高比", value=2.5)
+                    bucket_preview_button = gr.Button("Preview Buckets / 分桶预览")
+                with gr.Row():
+                    output_format_input = gr.Dropdown(["JPEG", "WebP", "WebP Lossless"], value="JPEG",
+                                                      label="Output Format / 输出格式")
+                    output_quality_input = gr.Slider(50, 100, value=95, step=1, label="Quality / 质量")
+                    output_max_kb_input = gr.Number(label="Max Size KB (0 = off) / 体积上限KB（0为不限）", value=0)
+                    output_subsampling_input = gr.Dropdown(["4:4:4", "4:2:2", "4:2:0"], value="4:2:0",
+                                                           label="Chroma Subsampling / 色度抽样")
+                    output_progressive_input = gr.Checkbox(label="Progressive JPEG / 渐进式JPEG", value=True)
 
                 with gr.Row():
                     # Add a Markdown component to display the warning message
                     gr.Markdown("""
-                ⚠ **Warning / 警告**: This preprocessing process will resize and compress all image files into jpg format with a total pixel count ≤ 1024×1024 while maintaining the original aspect ratio, ensuring that both dimensions are multiples of 32. **Please make sure to backup your original files before processing!** This procedure can reduce the size of the training set, help to speed up the labeling process, and decrease the time taken to cache latents to disk during training.
+                ⚠ **Warning / 警告**: This preprocessing process resizes and crops every image to the nearest aspect-ratio bucket (the built-in ≈1024×1024 set for "Default", otherwise the buckets generated from the base resolution, step and aspect limits above; preview them with "Preview Buckets") and re-encodes it in the chosen output format (JPEG, WebP or lossless WebP) at the chosen quality and size limit. **The original files and any other non-caption files in the folder are deleted afterwards, so please make sure to backup your original files before processing!** This procedure can reduce the size of the training set, help to speed up the labeling process, and decrease the time taken to cache latents to disk during training.
 
-                本预处理过程将会在保持原图长宽比情况下，把所有图像文件裁剪压缩为总像素≤1024×1024的jpg文件，并且长宽像素均为32的倍数。**请务必在处理前备份源文件！**该过程可以缩小训练集体积，有助于加快打标速度，并缩短训练过程中的Cache latents to disk时间。
+                本预处理过程会把每张图像缩放裁剪到宽高比最接近的分桶（“Default”为内置的约1024×1024分桶，否则按上方基准分辨率、边长倍数和宽高比范围生成，可用“分桶预览”查看），并按所选输出格式（JPEG、WebP 或无损 WebP）、质量和体积上限重新编码。**处理完成后会删除原文件及文件夹内其他非标签文件，请务必在处理前备份源文件！**该过程可以缩小训练集体积，有助于加快打标速度，并缩短训练过程中的Cache latents to disk时间。
                     """)
 
                 with gr.Row():
@@ -336,9 +760,22 @@ def on_ui_tabs():
                         lines=3
                     )
 
-                process_images_button.click(process_images_in_folder,
-                    inputs=[folder_path_input],
+                bucket_inputs = [bucket_base_input, bucket_step_input, bucket_min_ratio_input, bucket_max_ratio_input]
+                process_images_button.click(process_image_folder,
+                    inputs=[folder_path_input, process_pool_input, process_workers_input, force_process_input] + bucket_inputs
+                           + [output_format_input, output_quality_input, output_max_kb_input, output_subsampling_input,
+                              output_progressive_input],
                     outputs=[image_processing_output])
+                bucket_preview_button.click(preview_buckets, inputs=[folder_path_input] + bucket_inputs,
+                                            outputs=[image_processing_output])
+
+            with gr.Tab("Dataset Statistics / 数据集统计"):
+                with gr.Row():
+                    stats_folder_input = gr.Textbox(label="Image Folder Path / 图像文件夹路径",
+                                                    placeholder="Enter the directory path / 输入目录路径")
+                    stats_button = gr.Button("Analyze / 统计", variant='primary')
+                stats_output = gr.Textbox(label="Histograms (header only, no decoding) / 直方图（仅读取文件头）", lines=20)
+                stats_button.click(metadata_report, inputs=[stats_folder_input], outputs=stats_output)
 
             with gr.Tab("Single Image / 单图处理"):
                 with gr.Row():
@@ -354,24 +791,56 @@ def on_ui_tabs():
                 with gr.Row():
                     batch_process_submit = gr.Button("Batch Process Images / 批量处理图像", variant='primary')
                 with gr.Row():
-                    batch_output = gr.Textbox(label="Batch Processing Output / 批量输出")
+                    batch_output = gr.Textbox(label="Batch Processing Output / 批量输出", lines=6)
                     file_handling_mode = gr.Radio(
                         choices=["overwrite/覆盖", "prepend/前置插入", "append/末尾追加", "skip/跳过"],
                         value="overwrite/覆盖",
                         label="If a caption file exists: / 如果已经存在打标文件: "
                     )
+                    images_per_request_input = gr.Slider(label="Images per Request / 每次请求图片数", minimum=1,
+                                                         maximum=10, value=1, step=1)
+                with gr.Row():
+                    dedup_mode_input = gr.Radio(choices=["off", "skip", "copy"], value="off",
+                                                label="Near-duplicates: skip, or copy the representative's caption / "
+                                                      "近重复图像：跳过，或复制代表图的标签")
+                    dedup_threshold_input = gr.Slider(label="Duplicate Distance (bits) / 重复判定距离", minimum=0,
+                                                      maximum=16, value=4, step=1)
+                    find_duplicates_button = gr.Button("Find Duplicates / 查找重复")
+                    find_duplicates_button.click(lambda d, t: Dedup.dedup_report(d, int(t)),
+                                                 inputs=[batch_dir_input, dedup_threshold_input], outputs=batch_output)
                 with gr.Row():
                     stop_button = gr.Button("Stop Batch Processing / 停止批量处理")
                     stop_button.click(stop_batch_processing, inputs=[], outputs=batch_output)
 
+            with gr.Tab("Batch API / 离线批处理"):
+                gr.Markdown("""
+                    Export requests as JSONL, submit them to the Batch API and write results back as captions when the batch completes (usually within 24h, at a discount).\n
+                    将请求导出为JSONL并提交至Batch API，批次完成后（通常24小时内，价格更低）将结果写回打标文件。
+                    """)
+                with gr.Row():
+                    batch_api_dir_input = gr.Textbox(label="Image Directory / 图片目录",
+                                                     placeholder="Enter the directory path containing images")
+                    batch_api_out_input = gr.Textbox(label="JSONL Directory / JSONL目录",
+                                                     placeholder="Default: <image directory>_batch_api next to it")
+                    batch_api_mode = gr.Radio(choices=["overwrite/覆盖", "prepend/前置插入", "append/末尾追加", "skip/跳过"],
+                                              value="overwrite/覆盖",
+                                              label="If a caption file exists: / 如果已经存在打标文件: ")
+                with gr.Row():
+                    batch_api_export_button = gr.Button("Export JSONL / 导出")
+                    batch_api_submit_button = gr.Button("Submit / 提交", variant='primary')
+                    batch_api_poll_button = gr.Button("Check & Ingest / 检查并写回")
+                batch_api_output = gr.Textbox(label="Output / 结果", lines=5)
+
             with gr.Tab("Failed File Screening / 打标失败文件筛查"):
                 folder_input = gr.Textbox(label="Folder Input / 文件夹输入", placeholder="Enter the directory path")
                 keywords_input = gr.Textbox(placeholder="Enter keywords, e.g., sorry,error / 请输入检索关键词，例如：sorry,error",
                                             label="Keywords (optional) / 检索关键词（可选）")
+                screening_dry_run_input = gr.Checkbox(label="Dry Run (preview only) / 试运行（仅预览）", value=False)
                 run_button = gr.Button("Run Script / 运行脚本", variant='primary')
-                output_area = gr.Textbox(label="Script Output / 脚本输出")
+                output_area = gr.Textbox(label="Script Output / 脚本输出", lines=6)
 
-                run_button.click(fn=run_script, inputs=[folder_input, keywords_input], outputs=output_area)
+                run_button.click(fn=run_script, inputs=[folder_input, keywords_input, screening_dry_run_input],
+                                 outputs=output_area)
 
         with gr.Tab("Extra Function / 额外功能"):
 
@@ -392,7 +861,7 @@ def on_ui_tabs():
                 with gr.Row():
                     batch_detect_submit = gr.Button("Batch Detect Images / 批量检测图像", variant='primary')
                 with gr.Row():
-                    detect_batch_output = gr.Textbox(label="Output / 结果")
+                    detect_batch_output = gr.Textbox(label="Output / 结果", lines=6)
                 with gr.Row():
                     detect_stop_button = gr.Button("Stop Batch Processing / 停止批量处理")
                     detect_stop_button.click(stop_batch_processing, inputs=[], outputs=detect_batch_output)
@@ -410,7 +879,7 @@ def on_ui_tabs():
                             Use custom rules to filter images. Place images containing or not containing corresponding words in the corresponding rule folder in the answer. Output Directory default in source directory \classify_output.
                             """)
                 with gr.Row():
-                    classify_output = gr.Textbox(label="Output / 结果")
+                    classify_output = gr.Textbox(label="Output / 结果", lines=6)
                     classify_button = gr.Button("Run / 开始", variant='primary')
                     classify_stop_button = gr.Button("Stop Batch Processing / 停止批量处理")
                 with gr.Row():
@@ -424,38 +893,123 @@ def on_ui_tabs():
                         rule_type = gr.Dropdown(label="Rule / 规则类型", choices=["","Involve / 包含", "Exclude / 不包含"], value="")
                         rule_input = gr.Textbox(label="Custom / 自定义", placeholder="Enter the words you need to filter / 输入你需要筛选的词")
                         rule_inputs.extend([rule_type, rule_input])
+            with gr.Tab("Multi-Task / 单次多任务"):
+                gr.Markdown("""
+                            每张图只请求一次，同时得到标签、水印判断与分类回答，分别写入标签文件、水印目录和分类目录。分类规则使用“图片筛选”页中的规则；未填写分类问题时规则匹配标签内容。\n
+                            One request per image returns the caption, a watermark flag and the category answer, which go to the caption file, the watermark folder and the classification folders. Rules come from the Image filtering tab; without a category question they are matched against the caption.
+                            """)
+                with gr.Row():
+                    multi_dir = gr.Textbox(label="Image Directory / 图片目录", placeholder="Enter the directory path")
+                    multi_file_handling_mode = gr.Radio(
+                        choices=["overwrite/覆盖", "prepend/前置插入", "append/末尾追加", "skip/跳过"],
+                        value="overwrite/覆盖",
+                        label="If a caption file exists: / 如果已经存在打标文件: "
+                    )
+                with gr.Row():
+                    multi_watermark_prompt = gr.Textbox(label="Watermark Question / 水印问题",
+                                                        value=DEFAULT_WATERMARK_QUESTION)
+                    multi_watermark_dir = gr.Textbox(label="Watermark Detected Image Directory / 检测到水印的图片目录",
+                                                     placeholder="Default watermark_images next to the source directory / 默认源目录旁的watermark_images")
+                    multi_watermark_mode = gr.Radio(choices=["move/移动", "copy/复制"], value="move/移动",
+                                                    label="If watermark is detected / 如果图片检测到水印 ")
+                with gr.Row():
+                    multi_category_prompt = gr.Textbox(label="Category Question / 分类问题",
+                                                       placeholder="e.g. Is this a photo, an illustration or a 3D render?")
+                    multi_output_dir = gr.Textbox(label="Classify Output Directory / 分类输出目录",
+                                                  placeholder="Default source directory / 默认源目录")
+                    multi_classify_mode = gr.Radio(label="If meets / 如果符合", choices=["move/移动", "copy/复制"],
+                                                   value="copy/复制")
+                with gr.Row():
+                    multi_submit = gr.Button("Run / 开始", variant='primary')
+                    multi_stop_button = gr.Button("Stop Batch Processing / 停止批量处理")
+                with gr.Row():
+                    multi_output = gr.Textbox(label="Output / 结果", lines=6)
+                multi_stop_button.click(stop_batch_processing, inputs=[], outputs=multi_output)
 
         def caption_image(api_key, api_url, prompt, image, quality, timeout):
             if image:
                 return process_single_image(api_key, prompt, api_url, image, quality, timeout)
 
-        def batch_process(api_key, api_url, prompt, batch_dir, file_handling_mode, quality, timeout):
-            process_batch_images(api_key, prompt, api_url, batch_dir, file_handling_mode, quality, timeout)
-            return "Batch processing complete. Captions saved or updated as '.txt' files next to images."
+        def batch_process(api_key, api_url, prompt, batch_dir, file_handling_mode, quality, timeout, use_async,
+                          concurrency, use_cache, adaptive, job_id, retry_failed, images_per_request, dedup_mode,
+                          dedup_threshold):
+            job_id = job_id.strip()
 
-        def batch_detect(api_key, api_url, prompt, batch_dir, detect_file_handling_mode, quality, timeout, watermark_dir):
-            results = process_batch_watermark_detection(api_key, prompt, api_url, batch_dir, detect_file_handling_mode,
-                                                        quality, timeout,watermark_dir)
-            return results
+            def run(batch_progress):
+                try:
+                    finished_job, _ = process_batch_images(api_key, prompt, api_url, batch_dir, file_handling_mode,
+                                                           quality, timeout, use_async, int(concurrency), use_cache,
+                                                           adaptive, job_id, retry_failed, int(images_per_request),
+                                                           dedup_mode, int(dedup_threshold),
+                                                           batch_progress=batch_progress)
+                except ValueError as e:
+                    return f"Error: {e}"
+                return ("Batch processing complete. Captions saved or updated as '.txt' files next to images. "
+                        f"{Job_Journal.job_summary(finished_job)}")
+
+            # 生成器输出，处理过程中实时刷新进度
+            yield from stream_batch(run)
+
+        def batch_detect(api_key, api_url, prompt, batch_dir, detect_file_handling_mode, quality, timeout, watermark_dir,
+                         use_async, concurrency, use_cache, adaptive, job_id, retry_failed):
+            yield from stream_batch(process_batch_watermark_detection, api_key, prompt, api_url, batch_dir,
+                                    detect_file_handling_mode, quality, timeout, watermark_dir, use_async,
+                                    int(concurrency), use_cache, adaptive, job_id, retry_failed)
+
+        def batch_classify(*args):
+            yield from stream_batch(classify_images, *args)
+
+        def batch_multi_task(api_key, api_url, prompt, batch_dir, file_handling_mode, quality, timeout,
+                             watermark_prompt, watermark_dir, watermark_mode, category_prompt, o_dir, classify_mode,
+                             concurrency, use_cache, adaptive, job_id, retry_failed, *list_r):
+            yield from stream_batch(process_batch_multi_task, api_key, prompt, api_url, batch_dir, file_handling_mode,
+                                    quality, timeout, watermark_prompt, watermark_dir, watermark_mode,
+                                    category_prompt, o_dir, classify_mode, int(concurrency), use_cache, adaptive,
+                                    job_id, retry_failed, *list_r)
 
         single_image_submit.click(caption_image,
                                   inputs=[api_key_input, api_url_input, prompt_input, image_input, quality, timeout_input],
                                   outputs=single_image_output)
         batch_process_submit.click(batch_process,
                                    inputs=[api_key_input, api_url_input, prompt_input, batch_dir_input,
-                                           file_handling_mode, quality, timeout_input],
+                                           file_handling_mode, quality, timeout_input, async_input, concurrency_input,
+                                           cache_input, adaptive_input, job_id_input, retry_failed_input,
+                                           images_per_request_input, dedup_mode_input, dedup_threshold_input],
                                    outputs=batch_output)
         batch_detect_submit.click(batch_detect,
                                   inputs=[api_key_input, api_url_input, prompt_input, detect_batch_dir_input,
-                                          detect_file_handling_mode, quality, timeout_input, watermark_dir],
+                                          detect_file_handling_mode, quality, timeout_input, watermark_dir,
+                                          async_input, concurrency_input, cache_input, adaptive_input,
+                                          job_id_input, retry_failed_input],
                                   outputs=detect_batch_output)
 
-        classify_button.click(classify_images,
+        classify_button.click(batch_classify,
                               inputs=[api_key_input, api_url_input, quality, prompt_input, timeout_input,
-                                      classify_handling_mode, classify_dir, classify_output_dir] + rule_inputs,
+                                      classify_handling_mode, classify_dir, classify_output_dir,
+                                      async_input, concurrency_input, cache_input, adaptive_input,
+                                      job_id_input, retry_failed_input] + rule_inputs,
                               outputs=classify_output)
         classify_stop_button.click(stop_batch_processing,inputs=[],outputs=classify_output)
 
+        multi_submit.click(batch_multi_task,
+                           inputs=[api_key_input, api_url_input, prompt_input, multi_dir, multi_file_handling_mode,
+                                   quality, timeout_input, multi_watermark_prompt, multi_watermark_dir,
+                                   multi_watermark_mode, multi_category_prompt, multi_output_dir, multi_classify_mode,
+                                   concurrency_input, cache_input, adaptive_input, job_id_input,
+                                   retry_failed_input] + rule_inputs,
+                           outputs=multi_output)
+
+        batch_api_export_button.click(batch_api_export,
+                                      inputs=[prompt_input, quality, batch_api_dir_input, batch_api_out_input],
+                                      outputs=batch_api_output)
+        batch_api_submit_button.click(batch_api_submit,
+                                      inputs=[api_key_input, api_url_input, batch_api_dir_input, batch_api_out_input],
+                                      outputs=batch_api_output)
+        batch_api_poll_button.click(batch_api_poll,
+                                    inputs=[api_key_input, api_url_input, batch_api_dir_input, batch_api_out_input,
+                                            batch_api_mode],
+                                    outputs=batch_api_output)
+
         with gr.Tab("Tag Manage / 标签处理"):
 
             with gr.Row():
@@ -467,6 +1021,11 @@ def on_ui_tabs():
                                                          "Free translation / 免费翻译",
                                                          "No translation / 不翻译"],
                                                 value="No translation / 不翻译")
+                graph_measure_input = gr.Dropdown(["count", "pmi", "jaccard"], value="count",
+                                                  label="Graph Edge Measure / 网络图边权")
+                graph_layout_input = gr.Dropdown(["auto", "kamada_kawai", "spring", "spectral"], value="auto",
+                                                 label="Graph Layout / 网络图布局")
+                graph_dpi_input = gr.Dropdown(["100", "150", "300"], value="300", label="Graph DPI (100 = preview) / 网络图分辨率")
                 process_tags_button = gr.Button("Process Tags / 处理标签", variant='primary')
                 output_message = gr.Textbox(label="Output Message / 输出信息", interactive=False)
 
@@ -482,6 +1041,7 @@ def on_ui_tabs():
                 insert_position_input = gr.Radio(label="New Tag Insert Position / 新标签插入位置",
                                                  choices=["Start / 开始", "End / 结束", "Random / 随机"],
                                                  value="Start / 开始")
+                dry_run_tags_input = gr.Checkbox(label="Dry Run (count only) / 试运行（仅统计）", value=False)
 
             with gr.Row():
                 wordcloud_output = gr.Image(label="Word Cloud / 词云")
@@ -492,10 +1052,29 @@ def on_ui_tabs():
             with gr.Row():
                 network_graph_output = gr.Image(label="Network Graph / 网络图")
 
+            with gr.Accordion("Translation Cache / 翻译缓存", open=False):
+                with gr.Row():
+                    translation_cache_path_input = gr.Textbox(label="CSV Path / CSV路径",
+                                                              value=Translation_Cache.EXPORT_PATH)
+                    translation_cache_output = gr.Textbox(label="Cache State / 缓存状态", interactive=False)
+                with gr.Row():
+                    translation_stats_button = gr.Button("Refresh / 刷新")
+                    translation_export_button = gr.Button("Export / 导出")
+                    translation_import_button = gr.Button("Import / 导入")
+                    translation_clear_button = gr.Button("Clear Cache / 清空缓存")
+                translation_stats_button.click(Translation_Cache.cache_stats, inputs=[], outputs=translation_cache_output)
+                translation_export_button.click(Translation_Cache.export_csv, inputs=[translation_cache_path_input],
+                                                outputs=translation_cache_output)
+                translation_import_button.click(Translation_Cache.import_csv, inputs=[translation_cache_path_input],
+                                                outputs=translation_cache_output)
+                translation_clear_button.click(Translation_Cache.clear, inputs=[], outputs=translation_cache_output)
+
             process_tags_button.click(process_tags,
                                       inputs=[folder_path_input, top_n_input, tags_to_remove_input,
                                             tags_to_replace_input, new_tag_input, insert_position_input,
-                                            translate_tags_input, api_key_input, api_url_input], # 新增翻译复选框
+                                            translate_tags_input, api_key_input, api_url_input, # 新增翻译复选框
+                                            graph_measure_input, graph_layout_input, graph_dpi_input,
+                                            dry_run_tags_input],
                                       outputs=[tag_counts_output, wordcloud_output, network_graph_output, output_message])
         # API Config
         with gr.Tab("API Config / API配置"):
@@ -516,6 +1095,27 @@ def on_ui_tabs():
             switch_button.click(switch_API, inputs=[switch_select, A_state],
                                 outputs=[api_key_input, api_url_input, timeout_input, A_state])
             set_default.click(save_state, inputs=[switch_select, api_key_input, api_url_input], outputs=A_state)
+
+            # 连接池配置
+            with gr.Row():
+                pool_size_input = gr.Number(label="Connection Pool Size / 连接池大小", value=32, step=1)
+                keep_alive_input = gr.Checkbox(label="Keep-Alive / 长连接", value=True)
+                retry_total_input = gr.Number(label="Max Retries / 最大重试次数", value=5, step=1)
+                retry_backoff_input = gr.Number(label="Retry Backoff / 重试退避系数", value=1)
+                client_apply_button = gr.Button("Apply / 应用")
+            client_state = gr.Textbox(label="Connection State / 连接状态", interactive=False)
+            client_apply_button.click(apply_client_settings,
+                                      inputs=[pool_size_input, keep_alive_input, retry_total_input, retry_backoff_input],
+                                      outputs=client_state)
+
+            # 限速配置，作用于当前 API URL，0 表示不限
+            with gr.Row():
+                rpm_input = gr.Number(label="Requests per Minute / 每分钟请求数 (0 = unlimited)", value=0, step=1)
+                tpm_input = gr.Number(label="Tokens per Minute / 每分钟Token数 (0 = unlimited)", value=0, step=1000)
+                rate_limit_button = gr.Button("Apply Rate Limit / 应用限速")
+            rate_limit_state = gr.Textbox(label="Rate Limit State / 限速状态", interactive=False)
+            rate_limit_button.click(configure_rate_limit, inputs=[api_url_input, rpm_input, tpm_input],
+                                    outputs=rate_limit_state)
         gr.Markdown(
             "### Developers: [Jiaye](https://civitai.com/user/jiayev1),&nbsp;&nbsp;[LEOSAM 是只兔狲](https://civitai.com/user/LEOSAM),&nbsp;&nbsp;[SleeeepyZhou](https://civitai.com/user/SleeeepyZhou),&nbsp;&nbsp;[Fok](https://civitai.com/user/fok3827)&nbsp;&nbsp;|&nbsp;&nbsp;Welcome everyone to add more new features to this project.")
 